@@ -3,9 +3,10 @@ from tkinter import ttk, messagebox
 import requests
 import pandas as pd
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 from PIL import Image, ImageTk
 import numpy as np
@@ -13,6 +14,54 @@ from io import BytesIO
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from api_keys import aqi as aqi_api
+from tk_jobs import JobRunner
+from aqi_client import AQIClient, station_readings
+from aqi_cache import AQICache, SOURCE_TZ
+from aqi_engine import compute_aqi, aqi_category
+from aqi_history import AQIHistory
+
+
+DEFAULT_POLL_INTERVAL = 600    # Seconds, until a city's update times are known
+MIN_POLL_INTERVAL = 30
+
+
+def data_dir():
+    """Per-user directory for the dashboard's databases (AELOUS_DATA_DIR overrides it), created if missing."""
+    path = os.environ.get('AELOUS_DATA_DIR')
+    if not path:
+        if sys.platform == 'win32':
+            base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        elif sys.platform == 'darwin':
+            base = os.path.expanduser('~/Library/Application Support')
+        else:
+            base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+        path = os.path.join(base, 'aelous')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def set_text(label, text):
+    # Skip the Tk round trip (and re-layout) when nothing changed
+    if label.cget('text') != text:
+        label.config(text=text)
+
+
+def decimate_minmax(x, y, columns):
+    """Reduce a long series to the min and max of each of `columns` x-buckets.
+
+    Keeps the visual envelope of the line at any length; series that
+    already fit are returned unchanged.
+    """
+    if len(x) <= 2 * columns:
+        return x, y
+    edges = np.linspace(x[0], x[-1], columns + 1)
+    bucket = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, columns - 1)
+    # Sorting by (bucket, y) puts each bucket's min first and max last
+    order = np.lexsort((y, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(x)] - 1
+    keep = np.unique(np.concatenate([order[starts], order[ends]]))
+    return x[keep], y[keep]
 
 
 class AirQualityDashboard:
@@ -25,6 +74,9 @@ class AirQualityDashboard:
         # Constants
         self.API_BASE_URL = "https://api.data.gov.in/resource/3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69"
         self.API_KEY = aqi_api  # Replace with your data.gov.in key
+        # Kept per user, outside the source tree
+        self.CACHE_PATH = os.path.join(data_dir(), "aqi_cache.sqlite")
+        self.HISTORY_PATH = os.path.join(data_dir(), "aqi_history.sqlite")
 
         # Use CPCB categories for AQI
         self.aqi_categories = {
@@ -36,17 +88,38 @@ class AirQualityDashboard:
             'Severe': (401, 500, '#A87383', 'Affects healthy people and seriously impacts those with existing diseases')
         }
 
+        # Network fetches run on a background thread so the window stays responsive
+        self.jobs = JobRunner(self.root)
+        self.client = AQIClient(self.API_KEY, self.API_BASE_URL)
+        # Responses are reused until the source is due to publish again
+        self.cache = AQICache(self.client, self.CACHE_PATH)
+        # Every fetch is appended here; the Historical tab only queries it
+        self.history = AQIHistory(self.HISTORY_PATH)
+
         # Variables
         self.selected_city = tk.StringVar()
-        self.city_list = self.get_city_list()
+        self.city_list = []
+        self.stations = {}
+
+        # Auto refresh polls when the source is next due to publish
+        self.auto_refresh = tk.BooleanVar(value=False)
+        self.poll_after_id = None
+
+        # Station labels are reused across refreshes: name -> label, plus hidden spares
+        self.station_labels = {}
+        self.spare_station_labels = []
+        # Pollutant labels likewise: pollutant -> label, in display order, plus hidden spares
+        self.pollutant_labels = {}
+        self.spare_pollutant_labels = []
+        self.meter_category = None
+        self.charted_city = None
+        self.charted_columns = None
 
         # UI Setup
         self.setup_ui()
 
-        # Initialize with default city
-        if self.city_list:
-            self.selected_city.set(self.city_list[0])
-            self.get_air_quality_data()
+        # Load the cities, then initialize with the first one
+        self.get_city_list()
 
     def setup_ui(self):
         # Main panels
@@ -58,19 +131,25 @@ class AirQualityDashboard:
 
         # City selection
         ttk.Label(top_frame, text="Select City:", font=("Arial", 12)).pack(side=tk.LEFT, padx=5)
-        city_dropdown = ttk.Combobox(
+        self.city_dropdown = ttk.Combobox(
             top_frame,
             textvariable=self.selected_city,
             values=self.city_list,
             width=30,
             state="readonly"
         )
-        city_dropdown.pack(side=tk.LEFT, padx=5)
-        city_dropdown.bind("<<ComboboxSelected>>", lambda e: self.get_air_quality_data())
+        self.city_dropdown.pack(side=tk.LEFT, padx=5)
+        self.city_dropdown.bind("<<ComboboxSelected>>", lambda e: self.get_air_quality_data())
 
         refresh_button = ttk.Button(top_frame, text="Refresh Data", command=self.get_air_quality_data)
         refresh_button.pack(side=tk.LEFT, padx=10)
 
+        self.cancel_button = ttk.Button(top_frame, text="Cancel", command=self.jobs.cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        ttk.Checkbutton(top_frame, text="Auto refresh", variable=self.auto_refresh,
+                        command=self.schedule_poll).pack(side=tk.LEFT, padx=10)
+
         # Create tab control
         self.tab_control = ttk.Notebook(results_frame)
 
@@ -91,6 +170,7 @@ class AirQualityDashboard:
         self.tab_control.add(self.health_tab, text="Health Impact")
 
         self.tab_control.pack(expand=1, fill=tk.BOTH)
+        self.tab_control.bind("<<NotebookTabChanged>>", self.redraw_historical_data)
 
         # Setup each tab content
         self.setup_current_tab()
@@ -184,11 +264,16 @@ class AirQualityDashboard:
         self.historical_graph_frame = ttk.Frame(self.historical_tab)
         self.historical_graph_frame.pack(fill=tk.BOTH, expand=True, pady=10)
 
-        # We'll create the actual plot when data is available
+        # One persistent line; updates only replace its data
         self.historical_fig = plt.Figure(figsize=(9, 5), dpi=100)
         self.historical_ax = self.historical_fig.add_subplot(111)
+        self.historical_line, = self.historical_ax.plot([], [], label="AQI")
+        self.historical_ax.set_xlabel("Date")
+        self.historical_ax.set_ylabel("AQI")
+        self.historical_ax.xaxis_date(tz=SOURCE_TZ)
         self.historical_canvas = FigureCanvasTkAgg(self.historical_fig, master=self.historical_graph_frame)
         self.historical_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.historical_canvas.get_tk_widget().bind("<Configure>", self.redraw_historical_data, add='+')
 
     def setup_pollutant_tab(self):
         # Title label
@@ -228,97 +313,256 @@ class AirQualityDashboard:
 
     def get_city_list(self):
         """
-        Fetches the list of cities for the dropdown.
+        Fetches the list of cities for the dropdown in the background.
         """
-        # Simulate a list of cities (replace this with actual API request if needed)
-        return ['City1', 'City2', 'City3']
+        job = self.jobs.submit("Loading cities", lambda job: self.client.get_cities(),
+                               on_done=self.show_city_list, on_error=self.fetch_failed,
+                               on_cancel=self.fetch_cancelled)
+        if job is not None:
+            self.status_var.set("Loading cities...")
+            self.cancel_button.config(state=tk.NORMAL)
+
+    def show_city_list(self, job, cities):
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_var.set(f"{len(cities)} cities available")
+        self.city_list = cities
+        self.city_dropdown.config(values=cities)
+        if cities:
+            self.selected_city.set(cities[0])
+            self.get_air_quality_data()
 
     def get_air_quality_data(self):
         """
-        Fetches air quality data for the selected city from the API and updates the UI.
+        Fetches air quality data for the selected city in the background and updates the UI when done.
         """
         city = self.selected_city.get()
-        self.city_label.config(text=city)
-        self.datetime_label.config(text="Data updated: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-
-        # Simulating API call and response (use real API call to fetch data)
-        # Replace this block with actual API call code
+        if not city:
+            return
+        # Already-seen cities are shown straight from the cache; stale ones refresh in the background
+        records, state = self.cache.lookup(city)
+        if records is not None:
+            self.show_air_quality(None, self.air_quality_data(city, records, state))
+            return
+        job = self.jobs.submit(f"Fetching {city}", self.fetch_air_quality, city,
+                               on_done=self.show_air_quality, on_error=self.fetch_failed,
+                               on_progress=self.show_fetch_progress, on_cancel=self.fetch_cancelled)
+        if job is None:
+            self.status_var.set("A fetch is already running; wait for it or cancel it")
+            return
+        self.status_var.set(f"Fetching data for {city}...")
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def fetch_air_quality(self, job, city):
+        """
+        Runs on the job thread and returns the data for city; must not touch any widgets.
+        """
+        records, state = self.cache.get(city)
+        job.check()
+        return self.air_quality_data(city, records, state)
+
+    @staticmethod
+    def air_quality_data(city, records, cache_state):
+        stations = station_readings(records)
+        # One row per station, one column per pollutant
+        readings = pd.DataFrame({name: station['pollutants'] for name, station in stations.items()}).T
+        station_aqi = compute_aqi(readings) if len(readings) else pd.DataFrame(columns=['aqi'])
+        for name, row in station_aqi.iterrows():
+            stations[name]['aqi'] = None if pd.isna(row['aqi']) else int(row['aqi'])
+            stations[name]['dominant_pollutant'] = row['dominant_pollutant']
+        # The city AQI is the mean over stations that have one, as CPCB reports it
+        city_aqi = station_aqi['aqi'].mean()
+        aqi_value = None if pd.isna(city_aqi) else int(round(city_aqi))
+        return {
+            'city': city,
+            'aqi': aqi_value,
+            'category': "AQI not available" if aqi_value is None else aqi_category(aqi_value)[0],
+            'stations': stations,
+            'updated': datetime.now(),
+            'cache_state': cache_state,
+        }
 
-        # Mock Data for testing
-        aqi_value = 75
-        category = "Satisfactory"
-        stations = ["Station 1", "Station 2", "Station 3"]
+    def show_fetch_progress(self, job):
+        if job.message:
+            self.status_var.set(job.message)
 
-        self.aqi_value_label.config(text=str(aqi_value))
-        self.aqi_category_label.config(text=category)
+    def fetch_cancelled(self, job):
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_var.set(f"{job.name} cancelled")
 
-        # Clear previous stations
-        for widget in self.stations_frame.winfo_children():
-            widget.destroy()
+    def fetch_failed(self, job, error):
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_var.set(f"{job.name} failed")
+        messagebox.showerror("Error", f"Could not fetch air quality data: {error}")
 
-        # Display station data
-        for station in stations:
-            ttk.Label(self.stations_frame, text=station).pack(anchor=tk.W)
+    def show_air_quality(self, job, data):
+        """
+        Updates the UI with the data returned by fetch_air_quality.
+        """
+        self.cancel_button.config(state=tk.DISABLED)
+        stats = self.cache.stats()
+        note = " (stale, refreshing in background)" if data['cache_state'] == 'stale' else ""
+        self.status_var.set(f"Ready{note} | Cache: {stats['hits'] + stats['stale']} hits, "
+                            f"{stats['misses']} misses, {stats['refreshes']} background refreshes")
+        set_text(self.city_label, data['city'])
+        self.datetime_label.config(text="Data updated: " + data['updated'].strftime("%Y-%m-%d %H:%M:%S"))
+
+        aqi_value = data['aqi']
+        set_text(self.aqi_value_label, "--" if aqi_value is None else str(aqi_value))
+        set_text(self.aqi_category_label, data['category'])
+
+        # Display station data, touching only the labels whose text changed
+        self.stations = data['stations']
+        self.update_station_labels()
+        if list(self.station_dropdown.cget('values')) != list(self.stations):
+            self.station_dropdown.config(values=list(self.stations))
+        if self.stations:
+            if self.station_var.get() not in self.stations:
+                self.station_var.set(next(iter(self.stations)))
+            self.update_pollutant_data()
 
         # Update air quality meter visualization
         self.update_aqi_meter(aqi_value)
 
+        # Keep the local history growing and the chart current
+        new_rows = self.history.append(data['city'], self.stations)
+        if new_rows or data['city'] != self.charted_city:
+            self.update_historical_data()
+        self.schedule_poll()
+
+    def update_station_labels(self):
+        """Diff the station snapshot against the labels on screen and patch the differences."""
+        for station in list(self.station_labels):
+            if station not in self.stations:
+                label = self.station_labels.pop(station)
+                label.pack_forget()
+                self.spare_station_labels.append(label)
+        for station, reading in self.stations.items():
+            aqi_text = "AQI --" if reading.get('aqi') is None else f"AQI {reading['aqi']} ({reading['dominant_pollutant']})"
+            text = f"{station}: {aqi_text}, {reading['last_update']}"
+            label = self.station_labels.get(station)
+            if label is None:
+                label = self.spare_station_labels.pop() if self.spare_station_labels else ttk.Label(self.stations_frame)
+                label.config(text=text)
+                label.pack(anchor=tk.W)
+                self.station_labels[station] = label
+            else:
+                set_text(label, text)
+
+    def schedule_poll(self):
+        """(Re)arm the auto-refresh timer for when the selected city's data is next due."""
+        if self.poll_after_id is not None:
+            self.root.after_cancel(self.poll_after_id)
+            self.poll_after_id = None
+        if not self.auto_refresh.get():
+            return
+        expiry = self.cache.expiry(self.selected_city.get())
+        delay = DEFAULT_POLL_INTERVAL if expiry is None else expiry - datetime.now().timestamp()
+        self.poll_after_id = self.root.after(int(max(delay, MIN_POLL_INTERVAL) * 1000), self.poll)
+
+    def poll(self):
+        self.poll_after_id = None
+        city = self.selected_city.get()
+        if not city:
+            return
+        # Go to the network: the cached entry is due, so a lookup would only serve it stale
+        job = self.jobs.submit(f"Refreshing {city}", self.poll_air_quality, city,
+                               on_done=self.show_air_quality, on_error=self.poll_failed,
+                               on_cancel=self.fetch_cancelled)
+        if job is None:
+            # Something else is running; try again shortly
+            self.poll_after_id = self.root.after(int(MIN_POLL_INTERVAL * 1000), self.poll)
+
+    def poll_air_quality(self, job, city):
+        return self.air_quality_data(city, self.cache.fetch(city), 'refresh')
+
+    def poll_failed(self, job, error):
+        # Unattended: report in the status bar and keep polling instead of popping a dialog
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_var.set(f"{job.name} failed: {error}")
+        self.schedule_poll()
+
     def update_aqi_meter(self, aqi_value):
         """
         Updates the AQI meter based on the current AQI value.
         """
+        # Look up the CPCB category; the meter only changes with it
+        category = None if aqi_value is None else aqi_category(aqi_value)[0]
+        if category == self.meter_category:
+            return
+        self.meter_category = category
+
         # Clear the previous drawing
         self.aqi_meter_canvas.delete("all")
+        if category is None:
+            return
         
-        # Define meter ranges for colors and categories
-        for category, (min_val, max_val, color, description) in self.aqi_categories.items():
-            if min_val <= aqi_value <= max_val:
-                self.aqi_meter_canvas.create_oval(20, 20, 280, 130, fill=color, outline=color)  # Create circle
-                self.aqi_meter_canvas.create_text(150, 75, text=category, font=("Arial", 14), fill="white")
-                break
+        color = self.aqi_categories[category][2]
+        self.aqi_meter_canvas.create_oval(20, 20, 280, 130, fill=color, outline=color)  # Create circle
+        self.aqi_meter_canvas.create_text(150, 75, text=category, font=("Arial", 14), fill="white")
 
     def update_historical_data(self):
         """
         Updates the historical AQI data based on the selected time range.
         """
-        # Simulate historical data fetch based on selected range
+        # Range query with resampling done in SQLite; only the points to plot come back
         range_selected = self.time_range.get()
-        print(f"Fetching data for the last {range_selected}")
-        
-        # Here you would fetch the actual historical data and plot the graph
-        # Mock graph data for demonstration
-        dates = pd.date_range(datetime.now() - timedelta(days=7), periods=7)
-        aqi_values = np.random.randint(50, 150, size=7)
-
-        self.historical_ax.clear()
-        self.historical_ax.plot(dates, aqi_values, label="AQI")
+        self.charted_city = self.selected_city.get()
+        dates, aqi_values = self.history.recent(self.charted_city, range_selected)
+
+        # At most two points per pixel column reach matplotlib, however long the range
+        self.charted_columns = self.chart_columns()
+        x, y = decimate_minmax(mdates.date2num(dates) if dates else np.array([]),
+                               np.asarray(aqi_values, dtype=float), self.charted_columns)
+        self.historical_line.set_data(x, y)
+        self.historical_ax.relim()
+        self.historical_ax.autoscale_view()
         self.historical_ax.set_title(f"Historical AQI - Last {range_selected}")
-        self.historical_ax.set_xlabel("Date")
-        self.historical_ax.set_ylabel("AQI")
-        self.historical_canvas.draw()
+        self.historical_canvas.draw_idle()
+
+    def chart_columns(self):
+        # An unmapped widget (the tab isn't showing yet) reports a width of 1; fall back to
+        # the width it asks for, i.e. the figure's
+        widget = self.historical_canvas.get_tk_widget()
+        width = widget.winfo_width()
+        return width if width > 1 else max(1, widget.winfo_reqwidth())
+
+    def redraw_historical_data(self, event=None):
+        """
+        Re-decimates the historical chart when its tab is shown or resized to another width.
+        """
+        if self.charted_city is None or self.tab_control.select() != str(self.historical_tab):
+            return
+        if self.chart_columns() != self.charted_columns:
+            self.update_historical_data()
 
     def update_pollutant_data(self, event=None):
         """
-        Fetches and updates the pollutant data based on the selected station.
+        Updates the pollutant data for the selected station from the last fetch.
         """
         station = self.station_var.get()
-        print(f"Fetching pollutant data for {station}")
-        
-        # Simulate pollutant data update (Replace with actual API data)
-        pollutant_data = {
-            'PM2.5': 35,
-            'PM10': 45,
-            'CO': 0.5,
-            'NO2': 30
-        }
-        
-        # Clear previous pollutant data
-        for widget in self.pollutant_frame.winfo_children():
-            widget.destroy()
-
-        # Display new pollutant data
+        pollutant_data = self.stations.get(station, {}).get('pollutants', {})
+        texts = {}
         for pollutant, value in pollutant_data.items():
-            ttk.Label(self.pollutant_frame, text=f"{pollutant}: {value} µg/m³").pack(anchor=tk.W)
+            # CPCB reports CO in mg/m³, everything else in µg/m³
+            unit = "mg/m³" if pollutant == 'CO' else "µg/m³"
+            texts[pollutant] = f"{pollutant}: {'NA' if value is None else value} {unit}"
+
+        # Only repack when the pollutants (or their order) change; labels are reused, never destroyed
+        if list(texts) != list(self.pollutant_labels):
+            shown = self.pollutant_labels
+            for pollutant, label in shown.items():
+                label.pack_forget()
+                if pollutant not in texts:
+                    self.spare_pollutant_labels.append(label)
+            self.pollutant_labels = {}
+            for pollutant in texts:
+                label = shown.get(pollutant)
+                if label is None:
+                    label = self.spare_pollutant_labels.pop() if self.spare_pollutant_labels else ttk.Label(self.pollutant_frame)
+                label.pack(anchor=tk.W)
+                self.pollutant_labels[pollutant] = label
+        for pollutant, text in texts.items():
+            set_text(self.pollutant_labels[pollutant], text)
 
 if __name__ == "__main__":
     root = tk.Tk()
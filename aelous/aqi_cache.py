@@ -0,0 +1,157 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+MAX_ENTRIES = 256           # Cities kept in memory
+UPDATE_INTERVAL = 3600      # CPCB publishes hourly
+UPDATE_GRACE = 600          # Allow the upstream this long past the hour before expecting new data
+MIN_TTL = 120               # Floor for entries whose next update is overdue
+REFRESH_WORKERS = 2
+
+# CPCB stamps last_update in Indian Standard Time; IST has no DST, so the fixed offset is exact
+# where the tz database is missing (e.g. Windows without tzdata)
+try:
+    SOURCE_TZ = ZoneInfo('Asia/Kolkata')
+except ZoneInfoNotFoundError:
+    SOURCE_TZ = timezone(timedelta(hours=5, minutes=30), 'IST')
+
+
+def parse_last_update(value):
+    # e.g. "21-03-2025 14:00:00", IST whatever the host's timezone
+    try:
+        return datetime.strptime(value, "%d-%m-%Y %H:%M:%S").replace(tzinfo=SOURCE_TZ).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def expires_at(records, now):
+    """When cached records go stale: the next expected upstream update after their last_update."""
+    updates = [t for t in (parse_last_update(record.get('last_update')) for record in records) if t]
+    if not updates:
+        return now + UPDATE_INTERVAL
+    return max(max(updates) + UPDATE_INTERVAL + UPDATE_GRACE, now + MIN_TTL)
+
+
+class AQICache:
+    """Per-city cache of AQI records in front of AQIClient, with stale-while-revalidate.
+
+    Entries live in an in-memory LRU and, when db_path is given, in a
+    SQLite table that survives restarts. Each entry expires when the
+    source is next expected to publish, based on its records'
+    last_update. An expired entry is still returned at once while a
+    background refresh fetches the new data.
+    """
+
+    def __init__(self, client, db_path=None, max_entries=MAX_ENTRIES):
+        self.client = client
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # city -> (records, expires_at)
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS)
+        self.hits = self.stale = self.misses = self.refreshes = 0
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS aqi_cache (
+                    city TEXT PRIMARY KEY,
+                    records TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )""")
+            self.conn.commit()
+
+    def lookup(self, city):
+        """Cached records for city without touching the network.
+
+        Returns (records, state) with state 'hit' or 'stale', or
+        (None, None) if the city isn't cached. A stale entry schedules a
+        background refresh.
+        """
+        with self.lock:
+            entry = self.entries.get(city)
+            if entry is None:
+                entry = self.load(city)
+            if entry is None:
+                return None, None
+            self.entries[city] = entry
+            self.entries.move_to_end(city)
+            records, expiry = entry
+            if time.time() < expiry:
+                self.hits += 1
+                return records, 'hit'
+            self.stale += 1
+            if city not in self.refreshing:
+                self.refreshing.add(city)
+                self.pool.submit(self.refresh, city)
+            return records, 'stale'
+
+    def get(self, city):
+        """Records for city: cached if possible, fetched on a miss."""
+        records, state = self.lookup(city)
+        if records is not None:
+            return records, state
+        with self.lock:
+            self.misses += 1
+        return self.fetch(city), 'miss'
+
+    def fetch(self, city):
+        records = self.client.get_city(city)
+        self.store(city, records)
+        return records
+
+    def refresh(self, city):
+        try:
+            self.fetch(city)
+            with self.lock:
+                self.refreshes += 1
+        except Exception as e:
+            # Keep serving the stale copy; the next lookup retries
+            print(f"[!] Background refresh of {city} failed: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(city)
+
+    def store(self, city, records):
+        now = time.time()
+        expiry = expires_at(records, now)
+        with self.lock:
+            self.entries[city] = (records, expiry)
+            self.entries.move_to_end(city)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO aqi_cache VALUES (?, ?, ?, ?)",
+                                  (city, json.dumps(records), now, expiry))
+                self.conn.commit()
+
+    def load(self, city):
+        # Caller holds self.lock
+        if self.conn is None:
+            return None
+        row = self.conn.execute("SELECT records, expires_at FROM aqi_cache WHERE city = ?", (city,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def expiry(self, city):
+        """When city's cached entry goes stale, or None if it isn't cached in memory."""
+        with self.lock:
+            entry = self.entries.get(city)
+            return None if entry is None else entry[1]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'stale': self.stale, 'misses': self.misses,
+                    'refreshes': self.refreshes, 'entries': len(self.entries)}
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = "https://api.data.gov.in/resource/3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69"
+PAGE_SIZE = 1000            # Records per request; data.gov.in caps limit per call
+MAX_WORKERS = 8             # Cities fetched concurrently
+RETRIES = 3
+BACKOFF = 0.5               # Seconds; doubles on each retry
+TIMEOUT = 15
+
+
+class AQIClientError(Exception):
+    pass
+
+
+class AQIClient:
+    """Client for the CPCB real-time AQI resource on data.gov.in.
+
+    One pooled requests.Session is shared by every call. Transient failures
+    (connection errors, 429 and 5xx) are retried with exponential backoff,
+    station records are paged through with offset/limit, and many cities
+    are fetched at once on a bounded thread pool. base_url can point at a
+    local stub server for testing.
+    """
+
+    def __init__(self, api_key, base_url=API_BASE_URL, page_size=PAGE_SIZE, max_workers=MAX_WORKERS,
+                 retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), respect_retry_after_header=True)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests_made = 0
+
+    def fetch_page(self, offset, filters=None, fields=None):
+        params = {'api-key': self.api_key, 'format': 'json', 'offset': offset, 'limit': self.page_size}
+        for name, value in (filters or {}).items():
+            params[f'filters[{name}]'] = value
+        if fields:
+            params['fields'] = ",".join(fields)
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            self.requests_made += 1
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise AQIClientError(f"AQI request failed (offset {offset}): {e}") from e
+
+    def fetch_records(self, filters=None, fields=None):
+        """Every record matching filters, following offset/limit pagination.
+
+        The server may return fewer records than asked for (data.gov.in
+        caps limit per call), so a short page doesn't end the listing: the
+        offset advances by what came back, until a page is empty or the
+        reported total is reached.
+        """
+        records = []
+        offset = 0
+        while True:
+            page = self.fetch_page(offset, filters, fields)
+            batch = page.get('records', [])
+            records.extend(batch)
+            offset += len(batch)
+            total = int(page.get('total', 0) or 0)
+            if not batch or (total and offset >= total):
+                return records
+
+    def get_cities(self):
+        return sorted({record['city'] for record in self.fetch_records(fields=['city']) if record.get('city')})
+
+    def get_city(self, city):
+        return self.fetch_records(filters={'city': city})
+
+    def get_cities_data(self, cities, progress=None):
+        """Records for every city, fetched concurrently; failed cities map to the exception.
+
+        progress, if given, is called as progress(done, total) after every
+        city.
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {city: pool.submit(self.get_city, city) for city in cities}
+            for done, (city, future) in enumerate(futures.items(), 1):
+                try:
+                    results[city] = future.result()
+                except AQIClientError as e:
+                    results[city] = e
+                if progress is not None:
+                    progress(done, len(futures))
+        return results
+
+    def close(self):
+        self.session.close()
+
+
+def parse_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # The feed reports missing readings as "NA"
+        return None
+
+
+def station_readings(records):
+    """Group per-pollutant records into {station: {'last_update': ..., 'pollutants': {id: avg}}}."""
+    stations = {}
+    for record in records:
+        station = stations.setdefault(record.get('station', 'Unknown'), {
+            'last_update': record.get('last_update'),
+            'latitude': parse_value(record.get('latitude')),
+            'longitude': parse_value(record.get('longitude')),
+            'pollutants': {},
+        })
+        # Newer feed versions renamed pollutant_avg to avg_value
+        average = record.get('avg_value', record.get('pollutant_avg'))
+        station['pollutants'][record.get('pollutant_id')] = parse_value(average)
+    return stations
+
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# CPCB National AQI breakpoints: upper concentration of each band, for
+# AQI bands 0-50, 51-100, 101-200, 201-300, 301-400 and 401-500. Units are
+# µg/m³ except CO (mg/m³). The last band has no upper limit in the
+# standard; it is extended linearly to the value below and capped at 500.
+BREAKPOINTS = {
+    'PM10': [50, 100, 250, 350, 430, 510],
+    'PM2.5': [30, 60, 90, 120, 250, 380],
+    'NO2': [40, 80, 180, 280, 400, 520],
+    'O3': [50, 100, 168, 208, 748, 1000],
+    'CO': [1.0, 2.0, 10, 17, 34, 51],
+    'SO2': [40, 80, 380, 800, 1600, 2400],
+    'NH3': [200, 400, 800, 1200, 1800, 2400],
+    'Pb': [0.5, 1.0, 2.0, 3.0, 3.5, 4.0],
+}
+AQI_BANDS = np.array([0, 50, 100, 200, 300, 400, 500], dtype=np.float64)
+CATEGORIES = np.array(['Good', 'Satisfactory', 'Moderate', 'Poor', 'Very Poor', 'Severe'])
+POLLUTANTS = list(BREAKPOINTS)
+
+# Column names are matched case-insensitively; feed ids like OZONE map onto ours
+ALIASES = dict({pollutant.upper(): pollutant for pollutant in POLLUTANTS},
+               OZONE='O3', PM25='PM2.5')
+
+
+def sub_index(pollutant, concentrations):
+    """CPCB sub-index for an array of concentrations of one pollutant; NaN stays NaN."""
+    c = np.asarray(concentrations, dtype=np.float64)
+    upper = np.array(BREAKPOINTS[pollutant], dtype=np.float64)
+    lower = np.concatenate(([0.0], upper[:-1]))
+    # side='left' puts a value on a band's upper edge in that band
+    band = np.minimum(np.searchsorted(upper, c, side='left'), len(upper) - 1)
+    with np.errstate(invalid='ignore'):
+        index = AQI_BANDS[band] + (c - lower[band]) * (AQI_BANDS[band + 1] - AQI_BANDS[band]) / (
+            upper[band] - lower[band])
+    return np.clip(index, 0, AQI_BANDS[-1])
+
+
+def sub_indices(readings):
+    """Sub-index of every known pollutant column of readings (rows = station/hour)."""
+    readings = readings.rename(columns=lambda name: ALIASES.get(str(name).upper(), name))
+    columns = [pollutant for pollutant in POLLUTANTS if pollutant in readings.columns]
+    return pd.DataFrame({pollutant: sub_index(pollutant, readings[pollutant].to_numpy(dtype=np.float64))
+                         for pollutant in columns}, index=readings.index)
+
+
+def aqi_category(aqi):
+    """CPCB category name for each AQI value (None/NaN gives None)."""
+    aqi = np.atleast_1d(np.asarray(aqi, dtype=np.float64))
+    # Bands are 0-50, 51-100, ...: an AQI on an upper edge belongs to the lower band
+    names = CATEGORIES[np.minimum(np.searchsorted(AQI_BANDS[1:-1], aqi, side='left'), len(CATEGORIES) - 1)]
+    return np.where(np.isnan(aqi), None, names)
+
+
+def compute_aqi(readings, min_pollutants=3):
+    """Overall AQI, dominant pollutant and category for every row of readings.
+
+    readings is a DataFrame of concentrations with one column per
+    pollutant (PM2.5, PM10, NO2, SO2, CO, O3, NH3, Pb; feed ids such as
+    OZONE are accepted). Following CPCB, a row only gets an AQI when at
+    least min_pollutants sub-indices are available and one of them is
+    PM2.5 or PM10; the AQI is the largest sub-index.
+    """
+    indices = sub_indices(readings)
+    # A -inf column keeps argmax/max defined for rows (or frames) without any reading
+    values = np.column_stack([indices.to_numpy(), np.full(len(indices), -np.inf)])
+    available = ~np.isnan(values[:, :-1])
+    has_pm = indices[[p for p in ('PM2.5', 'PM10') if p in indices.columns]].notna().any(axis=1).to_numpy()
+    valid = (available.sum(axis=1) >= min_pollutants) & has_pm
+
+    filled = np.where(np.isnan(values), -np.inf, values)
+    names = np.append(np.asarray(indices.columns, dtype=object), None)
+    aqi = np.where(valid, np.round(filled.max(axis=1)), np.nan)
+    return pd.DataFrame({
+        'aqi': aqi,
+        'dominant_pollutant': np.where(valid, names[filled.argmax(axis=1)], None),
+        'category': aqi_category(aqi),
+    }, index=readings.index)
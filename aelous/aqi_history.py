@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+from datetime import datetime
+from aqi_cache import SOURCE_TZ, parse_last_update
+
+# Time range choices of the Historical tab: (span, resampling bucket) in seconds
+RANGES = {
+    '24h': (24 * 3600, 3600),
+    '7d': (7 * 24 * 3600, 6 * 3600),
+    '30d': (30 * 24 * 3600, 24 * 3600),
+}
+
+
+class AQIHistory:
+    """Local SQLite history of station AQI readings, appended to on every fetch.
+
+    Rows are keyed by (city, station, timestamp), so fetching the same
+    hour twice doesn't duplicate it, and indexed by (city, timestamp) so
+    a range query only touches the rows it returns. Resampling to the
+    plot's bucket size happens in SQL. Timestamps are UTC epoch seconds;
+    buckets are aligned to SOURCE_TZ (IST), so daily buckets start at
+    local midnight, and series() returns IST datetimes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS readings (
+                city TEXT NOT NULL,
+                station TEXT NOT NULL,
+                ts REAL NOT NULL,
+                aqi REAL,
+                dominant_pollutant TEXT,
+                PRIMARY KEY (city, station, ts)
+            );
+            CREATE INDEX IF NOT EXISTS readings_city_ts ON readings (city, ts);
+        """)
+        self.conn.commit()
+
+    def append(self, city, stations):
+        """Store the station readings returned by a fetch; returns the number of new rows."""
+        rows = []
+        for name, station in stations.items():
+            ts = parse_last_update(station.get('last_update'))
+            if ts is not None:
+                rows.append((city, name, ts, station.get('aqi'), station.get('dominant_pollutant')))
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def series(self, city, start, end, bucket):
+        """Mean AQI per bucket-second interval over [start, end), as (datetimes, values)."""
+        # Shift into IST wall-clock seconds to bucket, then back to epoch seconds
+        offset = datetime.fromtimestamp(start, SOURCE_TZ).utcoffset().total_seconds()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT CAST((ts + ?) / ? AS INTEGER) * ? - ? AS bucket, AVG(aqi) FROM readings "
+                "WHERE city = ? AND ts >= ? AND ts < ? AND aqi IS NOT NULL "
+                "GROUP BY bucket ORDER BY bucket",
+                (offset, bucket, bucket, offset, city, start, end)).fetchall()
+        return ([datetime.fromtimestamp(bucket_start, SOURCE_TZ) for bucket_start, _ in rows],
+                [value for _, value in rows])
+
+    def recent(self, city, range_name, now=None):
+        """series() for one of the RANGES, ending now."""
+        span, bucket = RANGES[range_name]
+        end = (now or datetime.now()).timestamp()
+        return self.series(city, end - span, end + 1, bucket)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,106 @@
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+
+SEED = 1234
+PIXEL_SIZE = 10.0
+ORIGIN = (500000.0, 2000000.0)   # UTM metres, zone 43N
+CRS = 'EPSG:32643'
+
+
+def water_field(size, rng):
+    """Smooth 0..1 field whose high values become lakes/rivers in the synthetic scene."""
+    coarse = rng.random((size // 64 + 2, size // 64 + 2))
+    field = np.kron(coarse, np.ones((64, 64)))[:size, :size]
+    return field
+
+
+def write_sentinel_scene(path, size, seed=SEED, tiled=True):
+    """8-band uint16 GeoTIFF shaped like the Sentinel-2 stacks poseidon reads.
+
+    Bands 2-4 are blue/green/red and band 8 is NIR. About a third of the
+    scene is water (green > NIR), so NDWI patch extraction has work to do.
+    """
+    rng = np.random.default_rng(seed)
+    water = water_field(size, rng) > 0.65
+    noise = rng.integers(0, 200, size=(size, size), dtype=np.uint16)
+    profile = {
+        'driver': 'GTiff', 'width': size, 'height': size, 'count': 8, 'dtype': 'uint16',
+        'crs': CRS, 'transform': from_origin(*ORIGIN, PIXEL_SIZE, PIXEL_SIZE),
+    }
+    if tiled:
+        profile.update(tiled=True, blockxsize=256, blockysize=256)
+    with rasterio.open(path, 'w', **profile) as dst:
+        for band in range(1, 9):
+            if band == 3:       # green
+                data = np.where(water, 2200, 900)
+            elif band == 8:     # NIR
+                data = np.where(water, 400, 3000)
+            else:
+                data = np.full((size, size), 1200)
+            dst.write((data + noise).astype(np.uint16), band)
+    return path
+
+
+def write_red_nir_pair(directory, size, seed=SEED):
+    """Single-band red and NIR GeoTIFFs with vegetated and built-up areas."""
+    rng = np.random.default_rng(seed)
+    vegetation = water_field(size, rng)
+    noise = rng.integers(0, 100, size=(size, size), dtype=np.uint16)
+    red = (1800 - 1200 * vegetation + noise).astype(np.uint16)
+    nir = (1500 + 2500 * vegetation + noise).astype(np.uint16)
+    paths = []
+    for name, data in (('red', red), ('nir', nir)):
+        path = os.path.join(directory, f"{name}_{size}.tif")
+        with rasterio.open(path, 'w', driver='GTiff', width=size, height=size, count=1, dtype='uint16',
+                           crs=CRS, transform=from_origin(*ORIGIN, PIXEL_SIZE, PIXEL_SIZE),
+                           tiled=True, blockxsize=256, blockysize=256) as dst:
+            dst.write(data, 1)
+        paths.append(path)
+    return tuple(paths)
+
+
+def write_scene_zip(path, scene_paths):
+    """Store scenes in a ZIP the way the Sentinel archives arrive (deflated members)."""
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for scene_path in scene_paths:
+            zf.write(scene_path, os.path.basename(scene_path))
+    return path
+
+
+def zone_grid(size, zones_per_side):
+    """Square zone polygons tiling the synthetic extent, as GeoJSON-like mappings."""
+    step = size * PIXEL_SIZE / zones_per_side
+    left, top = ORIGIN
+    zones = []
+    for i in range(zones_per_side):
+        for j in range(zones_per_side):
+            x0, y0 = left + j * step, top - (i + 1) * step
+            zones.append({'type': 'Polygon', 'coordinates': [[
+                (x0, y0), (x0 + step, y0), (x0 + step, y0 + step), (x0, y0 + step), (x0, y0)]]})
+    return zones
+
+
+def station_time_series(stations, hours, seed=SEED):
+    """Hourly pollutant readings for many stations, with the gaps real feeds have."""
+    rng = np.random.default_rng(seed)
+    rows = stations * hours
+    readings = pd.DataFrame({
+        'PM2.5': rng.gamma(2.0, 30.0, rows),
+        'PM10': rng.gamma(2.0, 60.0, rows),
+        'NO2': rng.gamma(2.0, 20.0, rows),
+        'SO2': rng.gamma(2.0, 10.0, rows),
+        'CO': rng.gamma(2.0, 0.6, rows),
+        'O3': rng.gamma(2.0, 25.0, rows),
+        'NH3': rng.gamma(2.0, 15.0, rows),
+        'Pb': rng.gamma(2.0, 0.2, rows),
+    })
+    # About 10% of readings missing
+    readings = readings.mask(rng.random(readings.shape) < 0.1)
+    readings.index = pd.MultiIndex.from_product(
+        [[f"station_{i}" for i in range(stations)],
+         pd.date_range('2025-01-01', periods=hours, freq='h')], names=['station', 'time'])
+    return readings
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for module_dir in ('poseidon', 'gaia', 'aelous', 'benchmarks'):
+    sys.path.insert(0, os.path.join(ROOT, module_dir))
+sys.path.insert(0, ROOT)
+
+import fixtures
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SIZES = [1024, 4096]            # Scene sides in pixels; add 10240 for full Sentinel-2 tiles
+TOLERANCE = 0.2                 # Worse than baseline by more than this is a regression
+COMPARED = (('seconds', '{:.3f}s'), ('peak_rss_mb', '{:.1f} MB'), ('bytes_read', '{:.0f} B'))
+STATIONS = 500
+HOURS = 24 * 30
+
+
+def bytes_read():
+    # Linux only: bytes this process read through read() calls, page cache included
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def extract_tiff_module(work_dir, **config):
+    os.chdir(work_dir)
+    import extract_tiff
+    extract_tiff.OUTPUT_DIR = os.path.join(work_dir, 'patches')
+    os.makedirs(extract_tiff.OUTPUT_DIR, exist_ok=True)
+    extract_tiff.TEMP_UNZIP_DIR = os.path.join(work_dir, 'temp_unzip')
+    for name, value in config.items():
+        setattr(extract_tiff, name, value)
+    return extract_tiff
+
+
+def case_extract(work_dir, scene, size, engine):
+    extract_tiff = extract_tiff_module(work_dir, ENGINE=engine, OUTPUT_FORMAT='npy')
+    start = time.perf_counter()
+    patches = extract_tiff.extract_water_patches(scene)
+    return time.perf_counter() - start, {'pixels': size * size, 'patches': patches or 0}
+
+
+def case_zip(work_dir, zip_path, member, size, read_mode):
+    extract_tiff = extract_tiff_module(work_dir, READ_MODE=read_mode, OUTPUT_FORMAT='npy')
+    start = time.perf_counter()
+    patches, _, _ = extract_tiff.process_scene(zip_path, member)
+    return time.perf_counter() - start, {'pixels': size * size, 'patches': patches or 0}
+
+
+def case_ndvi(work_dir, red, nir, size, zones_per_side):
+    from ndvi_engine import NDVIEngine
+    engine = NDVIEngine(red, nir)
+    start = time.perf_counter()
+    if zones_per_side:
+        engine.run_zones(0.3, fixtures.zone_grid(size, zones_per_side))
+    else:
+        engine.run(0.3)
+    return time.perf_counter() - start, {'pixels': size * size}
+
+
+def case_aqi(work_dir, stations, hours):
+    from aqi_engine import compute_aqi
+    readings = fixtures.station_time_series(stations, hours)
+    start = time.perf_counter()
+    compute_aqi(readings)
+    return time.perf_counter() - start, {'rows': len(readings)}
+
+
+def case_aqi_category(work_dir, count):
+    import numpy as np
+    from aqi_engine import aqi_category
+    values = np.random.default_rng(fixtures.SEED).uniform(0, 500, count).round()
+    start = time.perf_counter()
+    aqi_category(values)
+    return time.perf_counter() - start, {'rows': count}
+
+
+def run_case(fn, args):
+    """Run one case in this (fresh) process and turn its counts into throughput figures."""
+    read_before = bytes_read()
+    seconds, counts = fn(*args)
+    read_after = bytes_read()
+    result = {'seconds': round(seconds, 4), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+    if read_before is not None:
+        result['bytes_read'] = read_after - read_before
+    if 'pixels' in counts:
+        result['mpix_per_s'] = round(counts['pixels'] / 1e6 / seconds, 2)
+    if 'patches' in counts:
+        result['patches'] = counts['patches']
+        result['patches_per_s'] = round(counts['patches'] / seconds, 1)
+    if 'rows' in counts:
+        result['rows_per_s'] = round(counts['rows'] / seconds)
+    return result
+
+
+def build_cases(fixture_dir, sizes):
+    cases = []
+    for size in sizes:
+        scene = os.path.join(fixture_dir, f"scene_{size}.tif")
+        if not os.path.exists(scene):
+            fixtures.write_sentinel_scene(scene, size)
+        zip_path = os.path.join(fixture_dir, f"scenes_{size}.zip")
+        if not os.path.exists(zip_path):
+            fixtures.write_scene_zip(zip_path, [scene])
+        red = os.path.join(fixture_dir, f"red_{size}.tif")
+        nir = os.path.join(fixture_dir, f"nir_{size}.tif")
+        if not (os.path.exists(red) and os.path.exists(nir)):
+            red, nir = fixtures.write_red_nir_pair(fixture_dir, size)
+        member = os.path.basename(scene)
+        cases += [
+            (f"poseidon.extract_windowed[{size}]", case_extract, (scene, size, 'windowed')),
+            (f"poseidon.extract_full[{size}]", case_extract, (scene, size, 'full')),
+            (f"poseidon.zip_vsizip[{size}]", case_zip, (zip_path, member, size, 'vsizip')),
+            (f"poseidon.zip_extract[{size}]", case_zip, (zip_path, member, size, 'extract')),
+            (f"gaia.ndvi[{size}]", case_ndvi, (red, nir, size, 0)),
+            (f"gaia.ndvi_zones_100[{size}]", case_ndvi, (red, nir, size, 10)),
+        ]
+    cases += [
+        (f"aelous.compute_aqi[{STATIONS}x{HOURS}]", case_aqi, (STATIONS, HOURS)),
+        ("aelous.aqi_category[1e6]", case_aqi_category, (1000000,)),
+    ]
+    return cases
+
+
+def compare(results, baseline, tolerance):
+    """Names of the cases whose time, peak RSS or bytes read grew by more than tolerance."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print(f"  {name}: {result['seconds']:.3f}s (no baseline)")
+            continue
+        regressed = False
+        for metric, fmt in COMPARED:
+            # bytes_read is Linux only; a zero baseline has no meaningful ratio
+            if metric not in result or not base.get(metric):
+                continue
+            ratio = result[metric] / base[metric]
+            flag = "REGRESSION" if ratio > 1 + tolerance else "ok"
+            print(f"  {name} {metric}: {fmt.format(result[metric])} vs {fmt.format(base[metric])} "
+                  f"({ratio:.2f}x) {flag}")
+            regressed = regressed or ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks on synthetic fixtures.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Scene sides in pixels")
+    parser.add_argument('--only', help="Run only cases whose name contains this")
+    parser.add_argument('--fixtures', help="Directory to keep generated fixtures in between runs")
+    parser.add_argument('--output', help="Write this run's results as JSON")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Allowed growth in time, peak RSS or bytes read, e.g. 0.2")
+    args = parser.parse_args(argv)
+
+    fixture_dir = args.fixtures or tempfile.mkdtemp(prefix='elementa_bench_fixtures_')
+    os.makedirs(fixture_dir, exist_ok=True)
+    try:
+        return run_cases(args, fixture_dir)
+    finally:
+        # Generated fixtures run to GBs at full scene sizes; keep them only when asked to
+        if not args.fixtures:
+            shutil.rmtree(fixture_dir, ignore_errors=True)
+
+
+def run_cases(args, fixture_dir):
+    """Run the selected cases and compare them against the baseline; returns the exit status."""
+    cases = [case for case in build_cases(fixture_dir, args.sizes) if not args.only or args.only in case[0]]
+
+    results = {}
+    # A fresh spawned process per case keeps peak RSS and imports separate
+    context = multiprocessing.get_context('spawn')
+    for name, fn, case_args in cases:
+        with tempfile.TemporaryDirectory(prefix='elementa_bench_') as work_dir, \
+                ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                results[name] = pool.submit(run_case, fn, (work_dir,) + case_args).result()
+            except Exception as e:
+                print(f"[!] {name} failed: {e}")
+                continue
+        print(f"[DEBUG] {name}: {json.dumps(results[name])}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"[DEBUG] Saved baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"[DEBUG] No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print("Comparison against baseline:")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"[!] {len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
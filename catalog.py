@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import sqlite3
+import zipfile
+from datetime import date, datetime
+import rasterio
+from rasterio.warp import transform_bounds
+
+# Sentinel-2 style acquisition stamps in file names, e.g. S2A_MSIL2A_20230415T050701_...
+NAME_DATE = re.compile(r'(?<!\d)(20\d{2})(\d{2})(\d{2})(?:T\d{6})?(?!\d)')
+
+
+def scene_date(tags, name):
+    """Acquisition date from the TIFFTAG_DATETIME header tag, else from the file name."""
+    value = tags.get('TIFFTAG_DATETIME')
+    if value:
+        try:
+            return datetime.strptime(value[:10], "%Y:%m:%d").date().isoformat()
+        except ValueError:
+            pass
+    match = NAME_DATE.search(os.path.basename(name))
+    if match:
+        try:
+            return date(*map(int, match.groups())).isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def read_header(path, name=None):
+    """Footprint and metadata of one raster, read from its header only (no pixel data)."""
+    with rasterio.open(path) as src:
+        left, bottom, right, top = src.bounds
+        crs = src.crs
+        tags = src.tags()
+        header = {'crs': crs.to_string() if crs else None, 'width': src.width, 'height': src.height,
+                  'band_count': src.count, 'dtype': src.dtypes[0],
+                  'left': left, 'bottom': bottom, 'right': right, 'top': top}
+    # Footprints are indexed in lon/lat, so scenes in different UTM zones can be queried together
+    if crs is not None and not crs.is_geographic:
+        west, south, east, north = transform_bounds(crs, 'EPSG:4326', left, bottom, right, top, densify_pts=21)
+    else:
+        west, south, east, north = left, bottom, right, top
+    header.update(west=west, south=south, east=east, north=north, date=scene_date(tags, name or path))
+    return header
+
+
+def members_by_zip(scenes):
+    """{zip_path: set of member names} for the ZIP members among SceneCatalog.query() results."""
+    members = {}
+    for scene in scenes:
+        if scene['zip_path'] is not None:
+            members.setdefault(scene['zip_path'], set()).add(scene['member'])
+    return members
+
+
+class SceneCatalog:
+    """SQLite catalog of scene footprints with an R-tree over their lon/lat bounds.
+
+    Each .tif member of a ZIP (or a loose raster) is opened through GDAL
+    once, reading only its header: bounds, CRS, date and band count.
+    Members are keyed by size and CRC-32 and ZIPs by size and mtime, so
+    update() only opens what is new or changed. query() then returns the
+    scenes intersecting an AOI and date range without touching the
+    archives. SQLite builds without the R-tree module fall back to a plain
+    table with the same columns and queries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scenes (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                zip_path TEXT,
+                member TEXT,
+                size INTEGER NOT NULL,
+                crc INTEGER NOT NULL,
+                crs TEXT,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                band_count INTEGER NOT NULL,
+                dtype TEXT,
+                left REAL, bottom REAL, right REAL, top REAL,
+                date TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS scenes_zip ON scenes (zip_path);
+            CREATE INDEX IF NOT EXISTS scenes_date ON scenes (date);
+            CREATE TABLE IF NOT EXISTS zips (
+                zip_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL
+            );
+        """)
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree(id, west, east, south, north)")
+        except sqlite3.OperationalError:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS footprints (id INTEGER PRIMARY KEY, "
+                              "west REAL, east REAL, south REAL, north REAL)")
+        self.conn.commit()
+
+    def update(self, zip_dir):
+        """Catalog every .tif member of the ZIPs in zip_dir; returns (added, removed) scene counts."""
+        zip_paths = sorted(os.path.abspath(os.path.join(zip_dir, name)) for name in os.listdir(zip_dir)
+                           if name.lower().endswith('.zip'))
+        added = removed = 0
+        for zip_path in zip_paths:
+            if self.zip_is_current(zip_path):
+                continue
+            try:
+                a, r = self.update_zip(zip_path)
+            except zipfile.BadZipFile:
+                print(f"[!] Corrupt ZIP file: {os.path.basename(zip_path)}")
+                continue
+            added += a
+            removed += r
+        # Drop ZIPs that are gone from the directory
+        known = [row[0] for row in self.conn.execute("SELECT zip_path FROM zips")]
+        for zip_path in set(known) - set(zip_paths):
+            if os.path.dirname(zip_path) == os.path.abspath(zip_dir):
+                removed += self.remove(zip_path=zip_path)
+                self.conn.execute("DELETE FROM zips WHERE zip_path = ?", (zip_path,))
+        self.conn.commit()
+        return added, removed
+
+    def zip_is_current(self, zip_path):
+        row = self.conn.execute("SELECT size, mtime FROM zips WHERE zip_path = ?", (zip_path,)).fetchone()
+        stat = os.stat(zip_path)
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime)
+
+    def update_zip(self, zip_path):
+        zip_path = os.path.abspath(zip_path)
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            infos = [info for info in zf.infolist() if info.filename.lower().endswith('.tif')]
+        known = {row['member']: (row['size'], row['crc']) for row in self.conn.execute(
+            "SELECT member, size, crc FROM scenes WHERE zip_path = ?", (zip_path,))}
+        added = 0
+        for info in infos:
+            if known.get(info.filename) == (info.file_size, info.CRC):
+                continue
+            try:
+                header = read_header(f"/vsizip/{zip_path}/{info.filename}", info.filename)
+            except Exception as e:
+                print(f"[!] Could not read header of {info.filename}: {e}")
+                continue
+            self.store(f"/vsizip/{zip_path}/{info.filename}", header, info.file_size, info.CRC,
+                       zip_path, info.filename)
+            added += 1
+        members = {info.filename for info in infos}
+        removed = 0
+        for member in set(known) - members:
+            removed += self.remove(path=f"/vsizip/{zip_path}/{member}")
+        stat = os.stat(zip_path)
+        self.conn.execute("INSERT OR REPLACE INTO zips VALUES (?, ?, ?)", (zip_path, stat.st_size, stat.st_mtime))
+        self.conn.commit()
+        return added, removed
+
+    def update_files(self, paths):
+        """Catalog loose rasters, keyed by size and mtime; returns the number (re)read."""
+        added = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            row = self.conn.execute("SELECT size, crc FROM scenes WHERE path = ?", (path,)).fetchone()
+            # Loose files have no CRC; their mtime (in ms) stands in for it
+            key = (stat.st_size, int(stat.st_mtime * 1000))
+            if row is not None and tuple(row) == key:
+                continue
+            self.store(path, read_header(path), *key)
+            added += 1
+        self.conn.commit()
+        return added
+
+    def store(self, path, header, size, crc, zip_path=None, member=None):
+        self.remove(path=path)
+        cursor = self.conn.execute(
+            "INSERT INTO scenes (path, zip_path, member, size, crc, crs, width, height, band_count, dtype, "
+            "left, bottom, right, top, date, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, zip_path, member, size, crc, header['crs'], header['width'], header['height'],
+             header['band_count'], header['dtype'], header['left'], header['bottom'], header['right'],
+             header['top'], header['date'], time.time()))
+        self.conn.execute("INSERT INTO footprints VALUES (?, ?, ?, ?, ?)",
+                          (cursor.lastrowid, header['west'], header['east'], header['south'], header['north']))
+
+    def remove(self, path=None, zip_path=None):
+        column, value = ('path', path) if path is not None else ('zip_path', zip_path)
+        ids = [row[0] for row in self.conn.execute(f"SELECT id FROM scenes WHERE {column} = ?", (value,))]
+        self.conn.executemany("DELETE FROM footprints WHERE id = ?", [(i,) for i in ids])
+        self.conn.executemany("DELETE FROM scenes WHERE id = ?", [(i,) for i in ids])
+        return len(ids)
+
+    def query(self, aoi=None, start=None, end=None, min_bands=None):
+        """Scenes whose footprint intersects aoi and whose date falls in [start, end].
+
+        aoi is (west, south, east, north) in lon/lat; start and end are
+        dates or ISO strings and are inclusive. Scenes without a known date
+        are left out as soon as a date bound is given. Returns dicts with
+        the catalog columns, ordered by date and path.
+        """
+        sql = "SELECT s.* FROM scenes s JOIN footprints f ON f.id = s.id WHERE 1"
+        args = []
+        if aoi is not None:
+            west, south, east, north = aoi
+            sql += " AND f.west <= ? AND f.east >= ? AND f.south <= ? AND f.north >= ?"
+            args += [east, west, north, south]
+        if start is not None:
+            sql += " AND s.date >= ?"
+            args.append(str(start))
+        if end is not None:
+            sql += " AND s.date <= ?"
+            args.append(str(end))
+        if min_bands is not None:
+            sql += " AND s.band_count >= ?"
+            args.append(min_bands)
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY s.date, s.path", args)]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,208 @@
+import os
+import argparse
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio.coords import disjoint_bounds
+from rasterio.errors import WindowError
+from shapely.geometry import mapping
+from ndvi_engine import (NDVIEngine, BLOCK_SIZE, NUM_THREADS, NDVI_NODATA, METRICS, calculate_ndvi,
+                         cog_profile, map_region, no_zones, open_aligned, raster_grid, zone_labels)
+
+NDVI_THRESHOLD = 0.3
+PIXEL_SIZE = 10.0           # Meters; 10 for Sentinel-2, 30 for Landsat
+MAX_OPEN_DATASETS = 256     # Handles open at once across threads
+HANDLES_PER_DATE = 4        # Red and NIR, each with a WarpedVRT when off the first date's grid
+
+
+def read_time_series(scenes_csv):
+    """Dated scene pairs from a CSV with 'date', 'red' and 'nir' columns, sorted by date."""
+    scenes = pd.read_csv(scenes_csv, parse_dates=['date']).sort_values('date', kind='stable')
+    # Paths in the CSV are relative to the CSV itself
+    base = os.path.dirname(os.path.abspath(scenes_csv))
+    return [(row.date.date(), os.path.join(base, row.red), os.path.join(base, row.nir))
+            for row in scenes.itertuples()]
+
+
+def overlapping_scenes(scenes, gdf):
+    """The scenes whose red band footprint intersects the boundary; the rest are skipped with an event."""
+    kept = []
+    for scene in scenes:
+        scene_date, red_path, _ = scene
+        with rasterio.open(red_path) as src:
+            bounds = gdf.total_bounds if src.crs is None or gdf.crs is None else gdf.to_crs(src.crs).total_bounds
+            if disjoint_bounds(tuple(bounds), tuple(src.bounds)):
+                METRICS.event(f"Skipping {scene_date}: {os.path.basename(red_path)} doesn't overlap the boundary",
+                              date=scene_date, path=red_path)
+                continue
+        kept.append(scene)
+    return kept
+
+
+class GreenCoverChange:
+    """Green cover change over a stack of red/NIR scenes of one AOI.
+
+    The stack is streamed one BLOCK_SIZE window at a time: for each window
+    the dates are read one after another and folded into running sums, so
+    memory depends on the window size, not on the number of dates. Per
+    pixel it produces the NDVI trend (least-squares slope, NDVI per year)
+    and the first loss date: the first date a pixel that was green on the
+    first date is no longer green. Green uses the same NDVI and threshold
+    test as NDVIEngine. Scenes on a different grid from the first date's
+    red band are warped onto it window by window. A thread opens one
+    date's bands at a time and closes them before the next, so open
+    handles stay under MAX_OPEN_DATASETS however many dates there are.
+    """
+
+    def __init__(self, scenes, block_size=BLOCK_SIZE, num_threads=NUM_THREADS):
+        if len(scenes) < 2:
+            raise ValueError("Change detection needs at least two dates")
+        self.dates = [scene_date for scene_date, _, _ in scenes]
+        self.paths = [path for _, red_path, nir_path in scenes for path in (red_path, nir_path)]
+        # The first date's red band defines the grid, the region and the zone labels
+        self.engine = NDVIEngine(scenes[0][1], scenes[0][2], block_size, num_threads)
+        for path in self.paths:
+            with rasterio.open(path) as src:
+                if raster_grid(src) != self.engine.grid and (src.crs is None or self.engine.crs is None):
+                    raise ValueError(f"{os.path.basename(path)} is on another grid and has no CRS to align it")
+        # Time axis in years since the first date
+        self.years = np.array([(d - self.dates[0]).days / 365.25 for d in self.dates])
+
+    def process_block(self, src_window, threshold, shapes, zones):
+        transform = rasterio.windows.transform(src_window, self.engine.grid[1])
+        shape = (int(src_window.height), int(src_window.width))
+        labels = no_zones(shape)
+        outside = None
+        if shapes is not None:
+            labels = zone_labels(shapes, zones, shape, transform)
+            outside = ~labels.any(axis=0)
+
+        # Running sums for the least-squares slope, skipping invalid pixels
+        n = np.zeros(shape, dtype=np.float64)
+        sum_t = np.zeros(shape, dtype=np.float64)
+        sum_tt = np.zeros(shape, dtype=np.float64)
+        sum_y = np.zeros(shape, dtype=np.float64)
+        sum_ty = np.zeros(shape, dtype=np.float64)
+        baseline_green = None
+        first_loss = np.zeros(shape, dtype=np.int16)   # 1-based date index, 0 = no loss
+        for i, t in enumerate(self.years):
+            with ExitStack() as stack:
+                red_src, nir_src = (open_aligned(path, self.engine.grid, stack) for path in self.paths[2 * i:2 * i + 2])
+                red = red_src.read(1, window=src_window)
+                nir = nir_src.read(1, window=src_window)
+            ndvi = calculate_ndvi(red, nir)
+            if outside is not None:
+                ndvi[outside] = np.nan
+            valid = ~np.isnan(ndvi)
+            y = np.where(valid, ndvi, 0)
+            n += valid
+            sum_t += valid * t
+            sum_tt += valid * t * t
+            sum_y += y
+            sum_ty += y * t
+            # NaN compares False, so masked pixels are never green
+            green = ndvi > threshold
+            if baseline_green is None:
+                baseline_green = green
+            else:
+                first_loss[baseline_green & valid & ~green & (first_loss == 0)] = i + 1
+
+        denominator = n * sum_tt - sum_t * sum_t
+        with np.errstate(invalid='ignore', divide='ignore'):
+            trend = np.where((n >= 2) & (denominator > 0),
+                             (n * sum_ty - sum_t * sum_y) / denominator, np.nan).astype(np.float32)
+        # Loss pixels per (zone, date) over every label layer; label 0 is only used without shapes
+        num_zones = 0 if shapes is None else len(shapes)
+        lost = first_loss > 0
+        flat = labels[:, lost].astype(np.int64) * len(self.dates) + first_loss[lost] - 1
+        zone_loss = np.bincount(flat.ravel(), minlength=(num_zones + 1) * len(self.dates))
+        return trend, first_loss, zone_loss.reshape(num_zones + 1, len(self.dates))
+
+    def run(self, threshold, output_dir, shapes=None, progress=None):
+        """Write trend.tif and first_loss.tif to output_dir and return per-zone loss.
+
+        Returns an int64 array of lost pixels per (zone, date); without
+        shapes there is a single zone covering the whole extent.
+        first_loss.tif holds the 1-based index of the first loss date (0
+        for no loss), with the dates listed in its 'dates' tag.
+        """
+        try:
+            region = self.engine.region(shapes)
+        except WindowError:
+            raise ValueError(f"The boundary doesn't overlap the first date ({self.dates[0]}); "
+                             "drop such scenes with overlapping_scenes()")
+        meta = self.engine.region_meta(region)
+        zones = self.engine.zone_index(shapes)
+        num_zones = 0 if shapes is None else len(shapes)
+        zone_loss = np.zeros((num_zones + 1, len(self.dates)), dtype=np.int64)
+        num_threads = max(1, min(self.engine.num_threads, MAX_OPEN_DATASETS // HANDLES_PER_DATE))
+
+        def process(_, window, src_window):
+            return (window,) + self.process_block(src_window, threshold, shapes, zones)
+
+        trend_profile = cog_profile(dict(meta, dtype='float32', nodata=NDVI_NODATA))
+        loss_profile = cog_profile(dict(meta, dtype='int16', nodata=None))
+        with rasterio.open(os.path.join(output_dir, "trend.tif"), 'w', **trend_profile) as trend_dst, \
+                rasterio.open(os.path.join(output_dir, "first_loss.tif"), 'w', **loss_profile) as loss_dst:
+            loss_dst.update_tags(dates=",".join(d.isoformat() for d in self.dates))
+            # No shared handles: process_block opens each date's bands itself
+            for window, trend, first_loss, block_loss in map_region(
+                    region, self.engine.block_size, [], process, num_threads, progress):
+                trend_dst.write(np.nan_to_num(trend, nan=NDVI_NODATA), 1, window=window)
+                loss_dst.write(first_loss, 1, window=window)
+                zone_loss += block_loss
+        return zone_loss if shapes is None else zone_loss[1:]
+
+    def loss_table(self, zone_loss, zone_ids, pixel_size=PIXEL_SIZE):
+        """Loss area per zone and date, with the running total since the first date."""
+        rows = []
+        for zone_id, losses in zip(zone_ids, zone_loss):
+            cumulative = np.cumsum(losses)
+            for scene_date, lost, total in zip(self.dates[1:], losses[1:], cumulative[1:]):
+                rows.append({
+                    'zone': zone_id,
+                    'date': scene_date,
+                    'loss_area_sqkm': lost * pixel_size * pixel_size / 1e6,
+                    'cumulative_loss_area_sqkm': total * pixel_size * pixel_size / 1e6,
+                })
+        return pd.DataFrame(rows, columns=['zone', 'date', 'loss_area_sqkm', 'cumulative_loss_area_sqkm'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Green cover trend and loss over a time series of scenes.")
+    parser.add_argument('scenes', help="CSV of scenes with 'date', 'red' and 'nir' columns")
+    parser.add_argument('output_dir', help="Directory for trend.tif, first_loss.tif and zone_loss.csv")
+    parser.add_argument('--boundary', help="Boundary file; loss is reported per feature")
+    parser.add_argument('--id-field', help="Boundary attribute naming each zone (default: feature index)")
+    parser.add_argument('--threshold', type=float, default=NDVI_THRESHOLD, help="NDVI threshold for green")
+    parser.add_argument('--pixel-size', type=float, default=PIXEL_SIZE, help="Pixel size in meters")
+    args = parser.parse_args(argv)
+
+    METRICS.configure(echo=True)
+    scenes = read_time_series(args.scenes)
+    gdf = None
+    if args.boundary:
+        gdf = gpd.read_file(args.boundary)
+        scenes = overlapping_scenes(scenes, gdf)
+    change = GreenCoverChange(scenes)
+    shapes = None
+    zone_ids = ['all']
+    if gdf is not None:
+        if gdf.crs != change.engine.crs:
+            gdf = gdf.to_crs(change.engine.crs)
+        shapes = [mapping(geom) for geom in gdf.geometry]
+        zone_ids = gdf[args.id_field].tolist() if args.id_field else gdf.index.tolist()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    METRICS.event(f"{len(change.dates)} dates from {change.dates[0]} to {change.dates[-1]}",
+                  dates=len(change.dates))
+    zone_loss = change.run(args.threshold, args.output_dir, shapes)
+    table = change.loss_table(zone_loss, zone_ids, args.pixel_size)
+    table.to_csv(os.path.join(args.output_dir, "zone_loss.csv"), index=False)
+    METRICS.event(f"Wrote trend, first loss and {len(table)} zone/date rows to {args.output_dir}",
+                  rows=len(table))
+
+if __name__ == "__main__":
+    main()
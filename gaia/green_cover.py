@@ -1,13 +1,14 @@
 import os
-import numpy as np
 import matplotlib.pyplot as plt
-import rasterio
-from rasterio.mask import mask
 import geopandas as gpd
 from shapely.geometry import mapping
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from ndvi_engine import NDVIEngine, HIST_BINS, green_pixels_above
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from tk_jobs import JobRunner
 
 class GreenCoverCalculator:
     def __init__(self, root):
@@ -21,6 +22,20 @@ class GreenCoverCalculator:
         self.boundary_path = ""
         self.ndvi_threshold = tk.DoubleVar(value=0.3)
         self.pixel_size = tk.DoubleVar(value=10.0)  # Default to Sentinel-2 resolution
+        self.per_zone = tk.BooleanVar(value=False)
+        
+        # Persistent display artists, created on the first calculation
+        self.red_image = None
+        self.ndvi_image = None
+        
+        # NDVI histograms of the last calculation, keyed by its inputs
+        self.cache = None
+        self.threshold_pending = False
+        
+        # Raster work runs on a background thread so the window stays responsive
+        self.jobs = JobRunner(self.root)
+        self.progress_var = tk.DoubleVar(value=0)
+        self.status_var = tk.StringVar(value="Ready")
         
         self.create_widgets()
     
@@ -59,16 +74,23 @@ class GreenCoverCalculator:
         
         # Parameter widgets
         ttk.Label(param_frame, text="NDVI Threshold:").grid(row=0, column=0, sticky=tk.W, pady=2)
-        ttk.Scale(param_frame, from_=0.0, to=1.0, variable=self.ndvi_threshold, orient=tk.HORIZONTAL, length=200).grid(row=0, column=1, padx=5, pady=2)
+        ttk.Scale(param_frame, from_=0.0, to=1.0, variable=self.ndvi_threshold, orient=tk.HORIZONTAL, length=200, command=self.on_threshold_change).grid(row=0, column=1, padx=5, pady=2)
         ttk.Label(param_frame, textvariable=self.ndvi_threshold).grid(row=0, column=2, sticky=tk.W, pady=2)
         
         ttk.Label(param_frame, text="Pixel Size (meters):").grid(row=1, column=0, sticky=tk.W, pady=2)
         ttk.Entry(param_frame, textvariable=self.pixel_size, width=10).grid(row=1, column=1, sticky=tk.W, padx=5, pady=2)
         ttk.Label(param_frame, text="(10m for Sentinel-2, 30m for Landsat)").grid(row=1, column=2, sticky=tk.W, pady=2)
         
+        ttk.Checkbutton(param_frame, text="Per-zone statistics (one row per boundary feature)",
+                        variable=self.per_zone, command=self.on_threshold_change).grid(row=2, column=0, columnspan=3, sticky=tk.W, pady=2)
+        
         # Buttons
         ttk.Button(button_frame, text="Calculate Green Cover", command=self.calculate_green_cover).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Save Results", command=self.save_results).pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.jobs.cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        ttk.Progressbar(button_frame, variable=self.progress_var, maximum=100, length=200).pack(side=tk.LEFT, padx=5)
+        ttk.Label(button_frame, textvariable=self.status_var).pack(side=tk.LEFT, padx=5)
         
         # Results area (matplotlib)
         self.fig, (self.ax1, self.ax2) = plt.subplots(1, 2, figsize=(10, 5))
@@ -115,124 +137,155 @@ class GreenCoverCalculator:
             self.boundary_path = filepath
             self.boundary_label.config(text=os.path.basename(filepath))
 
+    def input_key(self):
+        return (self.red_path, self.nir_path, self.boundary_path, self.pixel_size.get())
+
     def calculate_green_cover(self):
         if not self.red_path or not self.nir_path:
             messagebox.showerror("Error", "Please select both Red and NIR band files")
             return
-    
-        try:
-            # Open raster files
-            with rasterio.open(self.red_path) as red_src, rasterio.open(self.nir_path) as nir_src:
-                red = red_src.read(1).astype('float32')
-                nir = nir_src.read(1).astype('float32')
-            
-            # Check if files have same shape
-                if red.shape != nir.shape:
-                    messagebox.showerror("Error", "Red and NIR bands have different dimensions")
-                    return
-            
-            # Create a meta profile for outputs
-                meta = red_src.meta.copy()
-            
-            # Apply boundary mask if provided
-                if self.boundary_path:
-                    try:
-                        # Read the boundary file
-                        gdf = gpd.read_file(self.boundary_path)
-                        if gdf.crs != red_src.crs:
-                            gdf = gdf.to_crs(red_src.crs)
-                    
-                    # Create shapes list for mask
-                        shapes = [mapping(geom) for geom in gdf.geometry]
-                        red, red_transform = mask(red_src, shapes, crop=True, nodata=0)
-                        red = red[0]
-                        nir, nir_transform = mask(nir_src, shapes, crop=True, nodata=0)
-                        nir = nir[0]
-                    # Update metadata for cropped image (if needed)
-                        meta.update({
-                            "height": red.shape[0],
-                            "width": red.shape[1],
-                            "transform": red_transform
-                        })
-                    except Exception as e:
-                        messagebox.showerror("Error", f"Error applying boundary mask: {str(e)}")
-                        return
-            
-            # Calculate NDVI safely: avoid division by zero
-                denominator = nir + red + 1e-6  # add a small number to avoid zero division
-                ndvi = (nir - red) / denominator
-            
-            # Apply threshold to create green mask
-                threshold = self.ndvi_threshold.get()
-                green_mask = ndvi > threshold
-            
-            # Calculate green cover statistics
-                total_pixels = np.sum(~np.isnan(ndvi))
-                green_pixels = np.sum(green_mask)
-                green_percentage = (green_pixels / total_pixels) * 100 if total_pixels > 0 else 0
-            
-            # Calculate area (using pixel size provided in meters)
-                pixel_size = self.pixel_size.get()  # assume this is in meters
-                total_area_sqkm = (total_pixels * pixel_size * pixel_size) / 1e6
-                green_area_sqkm = (green_pixels * pixel_size * pixel_size) / 1e6
-            
-            # Display results in text area
-                self.results_text.delete(1.0, tk.END)
-                results = (
-                    f"Green Cover Analysis Results:\n"
-                    f"------------------------\n"
-                    f"Total Area: {total_area_sqkm:.2f} sq km\n"
-                    f"Green Area: {green_area_sqkm:.2f} sq km\n"
-                    f"Green Coverage: {green_percentage:.2f}%\n"
-                    f"NDVI Threshold Used: {threshold}\n"
-                )
-                self.results_text.insert(tk.END, results)
-            
-            # Prepare images for display (downsample if necessary)
-            def downsample(image, max_dim=1024):
-                # Downsample an image array to max_dim pixels in each dimension if it's larger
-                import cv2
-                height, width = image.shape
-                scale = 1
-                if max(height, width) > max_dim:
-                    scale = max_dim / max(height, width)
-                    new_size = (int(width * scale), int(height * scale))
-                    image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
-                return image
-                        # Downsample for display only
-                red_display = downsample(red)
-                ndvi_display = downsample(ndvi)
-            
+        
+        # The NDVI histograms only depend on the inputs, not the threshold
+        if self.cache is not None and self.cache['key'] == self.input_key():
+            self.apply_threshold()
+            return
+        self.start_job("Calculating NDVI", self.compute_ndvi, self.show_ndvi, self.input_key(),
+                       self.ndvi_threshold.get())
+
+    def start_job(self, name, fn, on_done, *args):
+        job = self.jobs.submit(name, fn, *args, on_done=on_done, on_error=self.job_failed,
+                               on_progress=self.show_progress, on_cancel=self.job_cancelled)
+        if job is None:
+            messagebox.showerror("Error", "Another job is still running. Wait for it or cancel it first.")
+            return
+        self.progress_var.set(0)
+        self.status_var.set(f"{name}...")
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def show_progress(self, job):
+        done, total = job.progress
+        if total:
+            self.progress_var.set(100 * done / total)
+            self.status_var.set(f"{job.name}... {done}/{total} blocks")
+
+    def finish_job(self, status):
+        self.progress_var.set(0)
+        self.status_var.set(status)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def job_cancelled(self, job):
+        self.finish_job(f"{job.name} cancelled")
+
+    def job_failed(self, job, error):
+        self.finish_job(f"{job.name} failed")
+        if isinstance(error, ValueError):
+            messagebox.showerror("Error", str(error))
+        else:
+            messagebox.showerror("Error", f"An error occurred: {str(error)}")
+            import traceback
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    @staticmethod
+    def compute_ndvi(job, key, threshold):
+        # Runs on the job thread: no widget access here
+        red_path, nir_path, boundary_path, _ = key
+        engine = NDVIEngine(red_path, nir_path)
+        
+        # Restrict to the boundary if provided
+        shapes = None
+        zone_ids = []
+        if boundary_path:
+            try:
+                # Read the boundary file
+                gdf = gpd.read_file(boundary_path)
+                if gdf.crs != engine.crs:
+                    gdf = gdf.to_crs(engine.crs)
+                shapes = [mapping(geom) for geom in gdf.geometry]
+                zone_ids = gdf.index.tolist()
+            except Exception as e:
+                raise ValueError(f"Error applying boundary mask: {str(e)}")
+        
+        # Pixel counts and per-zone NDVI histograms, computed block by block
+        stats = engine.run(threshold, shapes, hist_bins=HIST_BINS, progress=job.report)
+        
+        # Decimated reads for display only, served from overviews when the files have them
+        job.check()
+        red_display, ndvi_display = engine.preview(shapes)
+        return {'key': key, 'stats': stats, 'zone_ids': zone_ids, 'engine': engine, 'shapes': shapes,
+                'red_display': red_display, 'ndvi_display': ndvi_display}
+
+    def show_ndvi(self, job, result):
+        red_display = result.pop('red_display')
+        ndvi_display = result.pop('ndvi_display')
+        if self.red_image is None:
             # Display RGB approximation using Red band (as grayscale)
-                self.ax1.clear()
-                self.ax1.imshow(red_display, cmap='gray')
-                self.ax1.set_title("Red Band (Grayscale)")
-                self.ax1.axis('off')
-            
-            # Display NDVI map
-                self.ax2.clear()
-                ndvi_img = self.ax2.imshow(ndvi_display, cmap='RdYlGn', vmin=-1, vmax=1)
-                self.ax2.set_title(f"NDVI Map (Green > {threshold})")
-                self.ax2.axis('off')
-                plt.colorbar(ndvi_img, ax=self.ax2, fraction=0.046, pad=0.04)
-            
-                self.fig.tight_layout()
-                self.canvas.draw()
-            
-            # Store results for saving
-                self.results = {
-                    'ndvi': ndvi,
-                    'green_mask': green_mask,
-                    'meta': meta,
-                    'total_area_sqkm': total_area_sqkm,
-                    'green_area_sqkm': green_area_sqkm,
-                    'green_percentage': green_percentage
-                }
+            self.red_image = self.ax1.imshow(red_display, cmap='gray')
+            self.ax1.set_title("Red Band (Grayscale)")
             
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            # Display NDVI map, with the one colorbar it keeps for the session
+            self.ndvi_image = self.ax2.imshow(ndvi_display, cmap='RdYlGn', vmin=-1, vmax=1)
+            plt.colorbar(self.ndvi_image, ax=self.ax2, fraction=0.046, pad=0.04)
+            self.fig.tight_layout()
+        else:
+            # Reuse the artists; only the pixels and extent change between runs
+            for image, data in ((self.red_image, red_display), (self.ndvi_image, ndvi_display)):
+                height, width = data.shape
+                image.set_data(data)
+                image.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+            self.red_image.autoscale()
+        
+        self.cache = result
+        self.finish_job("Ready")
+        self.apply_threshold()
+
+    def on_threshold_change(self, value=None):
+        # Coalesce slider events; re-evaluating from the cached histograms takes milliseconds
+        if self.cache is None or self.cache['key'] != self.input_key() or self.threshold_pending:
+            return
+        self.threshold_pending = True
+        self.root.after_idle(self.apply_threshold)
+
+    def apply_threshold(self):
+        self.threshold_pending = False
+        stats = self.cache['stats']
+        threshold = self.ndvi_threshold.get()
+        # Histogram estimates, good to one bin (0.001 NDVI); saving recounts exactly
+        estimate = dict(stats, green_pixels=int(green_pixels_above(stats['histogram'], threshold)),
+                        zone_green_pixels=green_pixels_above(stats['zone_histograms'], threshold)
+                        if self.cache['shapes'] is not None else [])
+        per_zone = self.cache['shapes'] is not None and self.per_zone.get()
+        summary = area_summary(estimate, self.pixel_size.get(), self.cache['zone_ids'] if per_zone else [])
+        
+        # Display results in text area
+        self.results_text.delete(1.0, tk.END)
+        results = (
+            f"Green Cover Analysis Results:\n"
+            f"------------------------\n"
+            f"Total Area: {summary['total_area_sqkm']:.2f} sq km\n"
+            f"Green Area: {summary['green_area_sqkm']:.2f} sq km\n"
+            f"Green Coverage: {summary['green_percentage']:.2f}%\n"
+            f"NDVI Threshold Used: {threshold}\n"
+            f"(Estimated to {2 / HIST_BINS:g} NDVI; saved results are exact)\n"
+        )
+        self.results_text.insert(tk.END, results)
+        
+        # Zone counts come out of the same pass, from one label raster per block
+        if summary['zones']:
+            self.results_text.insert(tk.END, "\nZone  Total (sq km)  Green (sq km)  Green %\n")
+            for row in summary['zones']:
+                self.results_text.insert(tk.END, "{}  {:.2f}  {:.2f}  {:.2f}%\n".format(*row))
+        
+        self.ax2.set_title(f"NDVI Map (Green > {threshold:.3f})")
+        self.canvas.draw_idle()
+        
+        # Store what saving needs; the rasters and their exact counts are only computed then
+        self.results = {
+            'engine': self.cache['engine'],
+            'shapes': self.cache['shapes'],
+            'threshold': threshold,
+            'pixel_size': self.pixel_size.get(),
+            'zone_ids': self.cache['zone_ids'] if per_zone else [],
+        }
 
     def save_results(self):
         if not hasattr(self, 'results'):
@@ -244,43 +297,65 @@ class GreenCoverCalculator:
         if not save_dir:
             return
         
+        self.start_job("Saving results", self.write_rasters, self.write_summary, save_dir, self.results)
+
+    @staticmethod
+    def write_rasters(job, save_dir, results):
+        # Save NDVI and green mask rasters as Cloud-Optimized GeoTIFFs, block by block
+        ndvi_path = os.path.join(save_dir, "ndvi.tif")
+        green_path = os.path.join(save_dir, "green_cover.tif")
+        counts = results['engine'].write_outputs(results['threshold'], ndvi_path, green_path,
+                                                 results['shapes'], progress=job.report)
+        return save_dir, results, counts
+
+    def write_summary(self, job, saved):
+        # Use the results the rasters were written from, even if the threshold moved since,
+        # and the exact counts of the written mask rather than the histogram estimates
+        save_dir, results, counts = saved
+        summary = area_summary(counts, results['pixel_size'], results['zone_ids'])
         try:
-            # Save NDVI raster
-            ndvi_path = os.path.join(save_dir, "ndvi.tif")
-            meta = self.results['meta'].copy()
-            meta.update(dtype='float32', nodata=-9999)
-            
-            with rasterio.open(ndvi_path, 'w', **meta) as dst:
-                dst.write(self.results['ndvi'].astype('float32'), 1)
-            
-            # Save green mask raster
-            green_path = os.path.join(save_dir, "green_cover.tif")
-            meta.update(dtype='uint8', nodata=0)
-            
-            with rasterio.open(green_path, 'w', **meta) as dst:
-                dst.write(self.results['green_mask'].astype('uint8'), 1)
-            
             # Save statistics as text
             stats_path = os.path.join(save_dir, "green_cover_stats.txt")
             with open(stats_path, 'w') as f:
-                f.write(f"Green Cover Analysis Results\n")
-                f.write(f"------------------------\n")
-                f.write(f"Total Area: {self.results['total_area_sqkm']:.2f} sq km\n")
-                f.write(f"Green Area: {self.results['green_area_sqkm']:.2f} sq km\n")
-                f.write(f"Green Coverage: {self.results['green_percentage']:.2f}%\n")
-                f.write(f"NDVI Threshold: {self.ndvi_threshold.get()}\n")
-                f.write(f"Pixel Size: {self.pixel_size.get()} meters\n")
+                f.write("Green Cover Analysis Results\n")
+                f.write("------------------------\n")
+                f.write(f"Total Area: {summary['total_area_sqkm']:.2f} sq km\n")
+                f.write(f"Green Area: {summary['green_area_sqkm']:.2f} sq km\n")
+                f.write(f"Green Coverage: {summary['green_percentage']:.2f}%\n")
+                f.write(f"NDVI Threshold: {results['threshold']}\n")
+                f.write(f"Pixel Size: {results['pixel_size']} meters\n")
+                if summary['zones']:
+                    f.write("\nZone, Total Area (sq km), Green Area (sq km), Green Coverage (%)\n")
+                    for zone_id, total_area, green_area, pct in summary['zones']:
+                        f.write(f"{zone_id}, {total_area:.4f}, {green_area:.4f}, {pct:.2f}\n")
             
             # Save NDVI plot
             plot_path = os.path.join(save_dir, "ndvi_map.png")
             self.fig.savefig(plot_path, dpi=300, bbox_inches='tight')
             
+            self.finish_job("Ready")
             messagebox.showinfo("Success", f"Results saved to {save_dir}")
             
         except Exception as e:
+            self.finish_job("Saving results failed")
             messagebox.showerror("Error", f"Error saving results: {str(e)}")
 
 
+def area_summary(counts, pixel_size, zone_ids):
+    """Areas in sq km (pixel_size in meters) and zone rows for the zone_ids given, from pixel counts."""
+    pixel_area = pixel_size * pixel_size / 1e6
+    total_pixels = counts['total_pixels']
+    green_pixels = counts['green_pixels']
+    zones = []
+    for zone_id, zone_total, zone_green in zip(zone_ids, counts['zone_total_pixels'], counts['zone_green_pixels']):
+        zone_pct = (zone_green / zone_total) * 100 if zone_total > 0 else 0
+        zones.append((zone_id, zone_total * pixel_area, zone_green * pixel_area, zone_pct))
+    return {'total_area_sqkm': total_pixels * pixel_area,
+            'green_area_sqkm': green_pixels * pixel_area,
+            'green_percentage': (green_pixels / total_pixels) * 100 if total_pixels > 0 else 0,
+            'zones': zones}
+
+
 def main():
     root = tk.Tk()
     app = GreenCoverCalculator(root)
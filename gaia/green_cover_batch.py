@@ -0,0 +1,168 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import mapping
+from tqdm import tqdm
+from ndvi_engine import NDVIEngine, METRICS
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from catalog import SceneCatalog
+
+NDVI_THRESHOLD = 0.3
+PIXEL_SIZE = 10.0           # Meters; 10 for Sentinel-2, 30 for Landsat
+NUM_WORKERS = os.cpu_count() or 1
+COLUMNS = ['scene', 'zone', 'status', 'total_pixels', 'green_pixels', 'total_area_sqkm', 'green_area_sqkm',
+           'green_percentage']
+
+
+def read_scenes(scenes_csv):
+    """Scene pairs from a CSV with 'red' and 'nir' columns and an optional 'scene' name."""
+    scenes = pd.read_csv(scenes_csv)
+    if 'scene' not in scenes.columns:
+        scenes['scene'] = [os.path.splitext(os.path.basename(path))[0] for path in scenes['red']]
+    # Paths in the CSV are relative to the CSV itself
+    base = os.path.dirname(os.path.abspath(scenes_csv))
+    for column in ('red', 'nir'):
+        scenes[column] = [os.path.join(base, path) for path in scenes[column]]
+    return scenes[['scene', 'red', 'nir']].to_dict('records')
+
+
+def filter_scenes(scenes, catalog_path, boundary_path, start=None, end=None):
+    """Scenes whose red band footprint intersects the boundary and is dated within [start, end].
+
+    Footprints come from the scene catalog at catalog_path, which only
+    reads the headers of rasters that are new or changed since the last
+    run, so scenes outside the AOI are never opened for processing.
+    """
+    catalog = SceneCatalog(catalog_path)
+    try:
+        catalog.update_files([scene['red'] for scene in scenes])
+        aoi = tuple(gpd.read_file(boundary_path).to_crs('EPSG:4326').total_bounds)
+        matching = {row['path'] for row in catalog.query(aoi, start, end)}
+    finally:
+        catalog.close()
+    return [scene for scene in scenes if os.path.abspath(scene['red']) in matching]
+
+
+def zone_ids_of(gdf, id_field):
+    return gdf[id_field].tolist() if id_field else gdf.index.tolist()
+
+
+def failed_rows(scene, zone_ids):
+    """Rows for a scene that could not be processed: every zone, status 'failed', no values."""
+    return [{'scene': scene['scene'], 'zone': zone_id, 'status': 'failed'} for zone_id in zone_ids]
+
+
+def scene_zone_stats(scene, boundary_path, id_field, threshold, pixel_size, num_threads):
+    """Per-zone green cover of one scene, one row per zone.
+
+    Zones the scene doesn't cover get 0 pixels and a NaN green_percentage
+    (no data) rather than being left out.
+    """
+    engine = NDVIEngine(scene['red'], scene['nir'], num_threads=num_threads)
+    gdf = gpd.read_file(boundary_path)
+    if gdf.crs != engine.crs:
+        gdf = gdf.to_crs(engine.crs)
+    zone_ids = zone_ids_of(gdf, id_field)
+    totals, greens = engine.run_zones(threshold, [mapping(geom) for geom in gdf.geometry])
+
+    rows = []
+    for zone_id, total, green in zip(zone_ids, totals, greens):
+        rows.append({
+            'scene': scene['scene'],
+            'zone': zone_id,
+            'status': 'done',
+            'total_pixels': int(total),
+            'green_pixels': int(green),
+            'total_area_sqkm': total * pixel_size * pixel_size / 1e6,
+            'green_area_sqkm': green * pixel_size * pixel_size / 1e6,
+            'green_percentage': green / total * 100 if total > 0 else np.nan,
+        })
+    return rows
+
+
+def measure_scene(scene, *args):
+    """scene_zone_stats inside a metrics scene; returns the rows and the scene record."""
+    with METRICS.scene(scene['scene']) as record:
+        rows = scene_zone_stats(scene, *args)
+        record.set(status='done')
+        record.add(zones=len(rows))
+    return rows, record.record
+
+
+def init_worker(metrics_enabled):
+    # Workers only build records; the parent writes and echoes them
+    METRICS.configure(enabled=metrics_enabled)
+
+
+def run_batch(scenes, boundary_path, output_path, id_field=None, threshold=NDVI_THRESHOLD,
+              pixel_size=PIXEL_SIZE, num_workers=NUM_WORKERS):
+    """Green cover for every zone of boundary_path in every scene, written as one table.
+
+    Scenes run in parallel worker processes; inside a worker the scene's
+    blocks are spread over threads, and each block is read once for all
+    zones that overlap it. Every scene gets a row per zone: a scene that
+    fails keeps its rows, with status 'failed' and empty values.
+    """
+    zone_ids = zone_ids_of(gpd.read_file(boundary_path), id_field)
+    num_workers = max(1, min(num_workers, len(scenes)))
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    rows = []
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                             initargs=(METRICS.enabled,)) as pool:
+        futures = {pool.submit(measure_scene, scene, boundary_path, id_field, threshold,
+                               pixel_size, num_threads): scene for scene in scenes}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing scenes"):
+            scene = futures[future]
+            try:
+                scene_rows, record = future.result()
+                rows.extend(scene_rows)
+                METRICS.add_record(record)
+            except Exception as e:
+                print(f"[!] Error processing {scene['scene']}: {e}")
+                rows.extend(failed_rows(scene, zone_ids))
+
+    table = pd.DataFrame(rows, columns=COLUMNS)
+    # Nullable integers keep pixel counts whole next to the failed scenes' missing values
+    table = table.astype({'total_pixels': 'Int64', 'green_pixels': 'Int64', 'total_area_sqkm': float,
+                          'green_area_sqkm': float, 'green_percentage': float})
+    table = table.sort_values(['scene', 'zone'], kind='stable').reset_index(drop=True)
+    if output_path.lower().endswith('.parquet'):
+        table.to_parquet(output_path, index=False)
+    else:
+        table.to_csv(output_path, index=False)
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-zone green cover statistics for many scenes.")
+    parser.add_argument('scenes', help="CSV of scene pairs with 'red' and 'nir' columns (optional 'scene')")
+    parser.add_argument('boundary', help="Boundary file with one polygon per zone")
+    parser.add_argument('output', help="Output table (.csv or .parquet)")
+    parser.add_argument('--id-field', help="Boundary attribute naming each zone (default: feature index)")
+    parser.add_argument('--threshold', type=float, default=NDVI_THRESHOLD, help="NDVI threshold for green")
+    parser.add_argument('--pixel-size', type=float, default=PIXEL_SIZE, help="Pixel size in meters")
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS, help="Scenes processed in parallel")
+    parser.add_argument('--metrics', help="Append per-scene timings and a run summary to this JSON-lines file")
+    parser.add_argument('--catalog', help="Scene catalog (SQLite); only scenes overlapping the boundary are run")
+    parser.add_argument('--start', help="With --catalog, only scenes dated on or after this (YYYY-MM-DD)")
+    parser.add_argument('--end', help="With --catalog, only scenes dated on or before this (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    METRICS.configure(args.metrics, echo=True)
+    scenes = read_scenes(args.scenes)
+    if args.catalog:
+        count = len(scenes)
+        scenes = filter_scenes(scenes, args.catalog, args.boundary, args.start, args.end)
+        METRICS.event(f"{len(scenes)} of {count} scenes overlap the boundary", scenes=len(scenes))
+    METRICS.event(f"{len(scenes)} scenes, boundary {os.path.basename(args.boundary)}", scenes=len(scenes))
+    table = run_batch(scenes, args.boundary, args.output, args.id_field, args.threshold,
+                      args.pixel_size, args.workers)
+    METRICS.event(f"Wrote {len(table)} rows to {args.output}", rows=len(table))
+    METRICS.report()
+
+if __name__ == "__main__":
+    main()
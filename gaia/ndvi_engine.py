@@ -0,0 +1,443 @@
+import os
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import rasterio
+import rasterio.shutil
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.features import geometry_window, rasterize
+from rasterio.transform import array_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from shapely.geometry import shape
+from shapely.validation import make_valid
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from spectral import normalized_difference
+from metrics import Metrics
+
+BLOCK_SIZE = 1024                   # Side of the square windows NDVI is computed over
+NUM_THREADS = os.cpu_count() or 1   # GDAL releases the GIL while reading, so threads overlap I/O
+HIST_BINS = 2000                    # NDVI histogram bins over [-1, 1], i.e. 0.001 resolution
+ALIGN_RESAMPLING = Resampling.bilinear  # Used when warping NIR (or later dates) onto the red grid
+PREVIEW_SIZE = 1024                 # Longest side of display previews
+NDVI_NODATA = -9999
+COG_OPTIONS = {'tiled': True, 'blockxsize': 512, 'blockysize': 512, 'compress': 'deflate',
+               'interleave': 'band', 'BIGTIFF': 'IF_SAFER'}
+
+# Shared by the gaia tools; spans are no-ops until a caller enables it
+METRICS = Metrics(enabled=False)
+
+
+def calculate_ndvi(red, nir):
+    # One float32 result and one scratch buffer, instead of a temporary per operation
+    return normalized_difference(nir, red)
+
+
+def ndvi_bins(ndvi, hist_bins=HIST_BINS):
+    """Histogram bin of every NDVI value, bin i covering [-1 + i * w, -1 + (i + 1) * w)."""
+    bins = ((ndvi + 1) * (hist_bins / 2)).astype(np.int64)
+    return np.clip(bins, 0, hist_bins - 1, out=bins)
+
+
+def green_pixels_above(histogram, threshold):
+    """Pixels with NDVI above threshold, from histograms along the last axis.
+
+    An estimate for interactive use: the threshold is rounded up to the
+    next bin edge, so pixels within one bin width of it can be counted on
+    the wrong side. Exact counts come from run() or write_outputs().
+    """
+    hist_bins = histogram.shape[-1]
+    first = min(max(int(np.ceil((threshold + 1) * hist_bins / 2)), 0), hist_bins)
+    return histogram[..., first:].sum(axis=-1)
+
+
+def block_counts(ndvi, labels, threshold, num_zones):
+    """Exact green and valid pixel counts of one block, overall and per zone.
+
+    Overall counts take each pixel once; zone counts go over every label
+    layer, so a pixel shared by overlapping zones counts for each of them
+    (label 0 is dropped). NaN compares False, so masked pixels are never
+    green. Returns (green, valid, counts).
+    """
+    green = ndvi > threshold
+    valid = ~np.isnan(ndvi)
+    counts = {'total': int(valid.sum()), 'green_total': int(green.sum()),
+              'totals': np.bincount(labels[:, valid].ravel(), minlength=num_zones + 1),
+              'greens': np.bincount(labels[:, green].ravel(), minlength=num_zones + 1)}
+    return green, valid, counts
+
+
+def count_stats(total_pixels, green_pixels, zone_totals, zone_greens):
+    return {
+        'total_pixels': total_pixels,
+        'green_pixels': green_pixels,
+        'green_percentage': (green_pixels / total_pixels) * 100 if total_pixels > 0 else 0,
+        'zone_total_pixels': zone_totals[1:],
+        'zone_green_pixels': zone_greens[1:],
+    }
+
+
+def cog_profile(meta):
+    return dict(meta, driver='GTiff', **COG_OPTIONS)
+
+
+def overview_factors(width, height, min_size=256):
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= min_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def block_windows(width, height, block_size=BLOCK_SIZE):
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def zone_index(zones):
+    """Bounds of every zone and the zones split into layers that don't overlap each other.
+
+    Returns (bounds, layer) where bounds is an (n, 4) array and layer[i]
+    is the layer of zones[i]. Zones that only share an edge stay in the
+    same layer, so a plain partition (wards, districts) is a single layer.
+    Overlaps are measured on repaired copies of invalid polygons (bowties,
+    self-intersections), which GEOS can't intersect as they are; the zones
+    themselves are burned unchanged.
+    """
+    geoms = [make_valid(shape(zone)) for zone in zones]
+    bounds = np.array([geom.bounds for geom in geoms]).reshape(-1, 4)
+    layer = np.zeros(len(geoms), dtype=np.int64)
+    for i in range(1, len(geoms)):
+        candidates = np.nonzero((bounds[:i, 0] < bounds[i, 2]) & (bounds[:i, 2] > bounds[i, 0]) &
+                                (bounds[:i, 1] < bounds[i, 3]) & (bounds[:i, 3] > bounds[i, 1]))[0]
+        taken = {int(layer[j]) for j in candidates if geoms[i].intersection(geoms[j]).area > 0}
+        layer[i] = next(k for k in range(len(taken) + 1) if k not in taken)
+    return bounds, layer
+
+
+def zone_labels(zones, zone_index, out_shape, transform):
+    """Label rasters for one block, shaped (layers, height, width).
+
+    In each layer a pixel is 0 outside that layer's zones and i + 1 inside
+    zones[i]. Overlapping zones are burned into different layers, so every
+    zone gets all of its pixels: a pixel shared by two zones counts fully
+    for both. Only zones whose bounds touch the block are burned.
+    """
+    bounds, layer = zone_index
+    labels = np.zeros((int(layer.max()) + 1 if len(layer) else 1,) + tuple(out_shape), dtype=np.int32)
+    left, bottom, right, top = array_bounds(out_shape[0], out_shape[1], transform)
+    touching = np.nonzero((bounds[:, 0] <= right) & (bounds[:, 2] >= left) &
+                          (bounds[:, 1] <= top) & (bounds[:, 3] >= bottom))[0]
+    for k in np.unique(layer[touching]):
+        labels[k] = rasterize(((zones[i], int(i) + 1) for i in touching if layer[i] == k), out_shape=out_shape,
+                              transform=transform, fill=0, dtype='int32')
+    return labels
+
+
+def no_zones(shape):
+    # Labels for a run without shapes: one layer, every pixel in "zone" 0
+    return np.zeros((1,) + tuple(shape), dtype=np.int32)
+
+
+def raster_grid(src):
+    return (src.crs, src.transform, src.width, src.height)
+
+
+def open_aligned(path, grid, stack):
+    """Open path on grid (crs, transform, width, height), warping it lazily if needed.
+
+    Rasters already on grid are returned as-is; anything else is wrapped in
+    a WarpedVRT, so each window read is resampled onto grid on the fly.
+    Everything opened is registered with the ExitStack stack as a close()
+    callback rather than a context: a dataset's __exit__ tears down the
+    GDAL environment of the thread that entered it, and map_region closes
+    the stacks of its worker threads from the consuming thread.
+    """
+    src = rasterio.open(path)
+    stack.callback(src.close)
+    if grid is None or raster_grid(src) == grid:
+        return src
+    crs, transform, width, height = grid
+    vrt = WarpedVRT(src, crs=crs, transform=transform, width=width, height=height, resampling=ALIGN_RESAMPLING)
+    stack.callback(vrt.close)
+    return vrt
+
+
+def map_region(region, block_size, paths, fn, num_threads=NUM_THREADS, progress=None, grid=None):
+    """Yield fn(datasets, window, src_window) for every block of region on a thread pool.
+
+    Each thread opens its own handles on paths (rasterio datasets can't be
+    shared between threads), aligned to grid if given; they are closed when
+    the generator finishes. Results are yielded as blocks finish, with at
+    most 2 * num_threads in flight.
+    """
+    windows = list(block_windows(region.width, region.height, block_size))
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def process(window):
+        if not hasattr(local, 'datasets'):
+            stack = ExitStack()
+            with lock:
+                opened.append(stack)
+            local.datasets = [open_aligned(path, grid, stack) for path in paths]
+        src_window = Window(region.col_off + window.col_off, region.row_off + window.row_off,
+                            window.width, window.height)
+        return fn(local.datasets, window, src_window)
+
+    num_threads = max(1, num_threads)
+    done = 0
+    try:
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            pending = set()
+            for window in windows:
+                pending.add(pool.submit(process, window))
+                if len(pending) < 2 * num_threads:
+                    continue
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done += 1
+                    if progress is not None:
+                        progress(done, len(windows))
+                    yield future.result()
+            for future in pending:
+                done += 1
+                if progress is not None:
+                    progress(done, len(windows))
+                yield future.result()
+    finally:
+        for stack in opened:
+            stack.close()
+
+
+class NDVIEngine:
+    """Green cover statistics for a red/NIR pair, computed window by window.
+
+    Blocks of BLOCK_SIZE pixels are read and reduced on a thread pool, each
+    thread with its own dataset handles, and only the green/total pixel
+    counts are accumulated. Full-size NDVI and green mask arrays are only
+    built when keep_arrays is set, e.g. for display and saving in the GUI.
+    """
+
+    def __init__(self, red_path, nir_path, block_size=BLOCK_SIZE, num_threads=NUM_THREADS):
+        self.red_path = red_path
+        self.nir_path = nir_path
+        self.block_size = block_size
+        self.num_threads = max(1, num_threads)
+        with rasterio.open(red_path) as red_src, rasterio.open(nir_path) as nir_src:
+            # The red band's grid is the output grid; NIR is warped onto it if it differs
+            self.grid = raster_grid(red_src)
+            self.aligned = raster_grid(nir_src) == self.grid
+            if not self.aligned and (red_src.crs is None or nir_src.crs is None):
+                raise ValueError("Red and NIR bands are on different grids and can't be aligned "
+                                 "without a CRS")
+            self.meta = red_src.meta.copy()
+            self.crs = red_src.crs
+
+    def region(self, shapes=None):
+        """Window of the rasters to process: everything, or the bounding box of shapes."""
+        if shapes is None:
+            return Window(0, 0, self.meta['width'], self.meta['height'])
+        with rasterio.open(self.red_path) as src:
+            region = geometry_window(src, shapes)
+        return Window(int(region.col_off), int(region.row_off), int(region.width), int(region.height))
+
+    def region_meta(self, region):
+        meta = self.meta.copy()
+        meta.update(height=region.height, width=region.width,
+                    transform=rasterio.windows.transform(region, self.meta['transform']))
+        return meta
+
+    @staticmethod
+    def zone_index(shapes):
+        return None if shapes is None else zone_index(shapes)
+
+    @staticmethod
+    def masked_ndvi(red_src, nir_src, src_window, shapes=None, zones=None):
+        """NDVI of one block and its zone labels (see zone_labels), NaN outside every shape."""
+        with METRICS.span('read'):
+            red = red_src.read(1, window=src_window)
+            nir = nir_src.read(1, window=src_window)
+        with METRICS.span('ndvi', pixels=red.size):
+            ndvi = calculate_ndvi(red, nir)
+        if shapes is None:
+            return ndvi, no_zones(ndvi.shape)
+        with METRICS.span('zones'):
+            labels = zone_labels(shapes, zones, ndvi.shape, red_src.window_transform(src_window))
+            ndvi[~labels.any(axis=0)] = np.nan
+        return ndvi, labels
+
+    def preview(self, shapes=None, max_dim=PREVIEW_SIZE):
+        """Red band and NDVI of the region, decimated to at most max_dim pixels a side.
+
+        The reads use out_shape, so GDAL serves them from the file's
+        overviews when it has them instead of reading full resolution.
+        """
+        region = self.region(shapes)
+        scale = min(1.0, max_dim / max(region.width, region.height))
+        out_shape = (max(1, int(region.height * scale)), max(1, int(region.width * scale)))
+        with ExitStack() as stack:
+            red_src = open_aligned(self.red_path, self.grid, stack)
+            nir_src = open_aligned(self.nir_path, self.grid, stack)
+            red = red_src.read(1, window=region, out_shape=out_shape,
+                               resampling=Resampling.average).astype(np.float32)
+            nir = nir_src.read(1, window=region, out_shape=out_shape, resampling=Resampling.average)
+        ndvi = calculate_ndvi(red, nir)
+        if shapes is not None:
+            transform = rasterio.windows.transform(region, self.meta['transform']) * Affine.scale(
+                region.width / out_shape[1], region.height / out_shape[0])
+            labels = zone_labels(shapes, self.zone_index(shapes), out_shape, transform)
+            ndvi[~labels.any(axis=0)] = np.nan
+        return red, ndvi
+
+    def write_outputs(self, threshold, ndvi_path, green_path, shapes=None, progress=None):
+        """Stream NDVI and the green mask into Cloud-Optimized GeoTIFFs.
+
+        Blocks are written into tiled temporary files, overviews are built
+        on those, and the result is copied with the overviews in front of
+        the full-resolution tiles so viewers can stream either. Returns the
+        exact pixel counts of the written green mask, in the same form as
+        run(), so saved summaries match the raster.
+        """
+        region = self.region(shapes)
+        meta = self.region_meta(region)
+        zones = self.zone_index(shapes)
+        outputs = [(ndvi_path, dict(meta, dtype='float32', nodata=NDVI_NODATA)),
+                   (green_path, dict(meta, dtype='uint8', nodata=0))]
+        temp_paths = [path + '.tmp.tif' for path, _ in outputs]
+
+        num_zones = 0 if shapes is None else len(shapes)
+
+        def process_block(red_src, nir_src, window, src_window):
+            ndvi, labels = self.masked_ndvi(red_src, nir_src, src_window, shapes, zones)
+            green, _, counts = block_counts(ndvi, labels, threshold, num_zones)
+            return window, np.nan_to_num(ndvi, nan=NDVI_NODATA), green.astype(np.uint8), counts
+
+        total_pixels = green_pixels = 0
+        zone_totals = np.zeros(num_zones + 1, dtype=np.int64)
+        zone_greens = np.zeros(num_zones + 1, dtype=np.int64)
+        try:
+            with rasterio.open(temp_paths[0], 'w', **cog_profile(outputs[0][1])) as ndvi_dst, \
+                    rasterio.open(temp_paths[1], 'w', **cog_profile(outputs[1][1])) as green_dst:
+                for window, ndvi, green, counts in self.map_blocks(region, process_block, progress):
+                    total_pixels += counts['total']
+                    green_pixels += counts['green_total']
+                    zone_totals += counts['totals']
+                    zone_greens += counts['greens']
+                    with METRICS.span('write'):
+                        ndvi_dst.write(ndvi, 1, window=window)
+                        green_dst.write(green, 1, window=window)
+                with METRICS.span('overviews'):
+                    for dst, resampling in ((ndvi_dst, Resampling.average), (green_dst, Resampling.nearest)):
+                        dst.build_overviews(overview_factors(region.width, region.height), resampling)
+                        dst.update_tags(ns='rio_overview', resampling=resampling.name)
+            with METRICS.span('write'):
+                for temp_path, (path, _) in zip(temp_paths, outputs):
+                    rasterio.shutil.copy(temp_path, path, driver='GTiff', copy_src_overviews=True,
+                                         **COG_OPTIONS)
+        finally:
+            for temp_path in temp_paths:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return count_stats(total_pixels, green_pixels, zone_totals, zone_greens)
+
+    def run(self, threshold, shapes=None, keep_arrays=False, hist_bins=None, progress=None):
+        """Count green and total pixels, optionally restricted to shapes.
+
+        Returns a dict with total_pixels, green_pixels, green_percentage and
+        the output meta (cropped to shapes, like rasterio.mask with
+        crop=True). Pixels outside shapes are NaN in 'ndvi' and are not
+        counted. With shapes, 'zone_total_pixels' and 'zone_green_pixels'
+        hold the same counts per shape; where shapes overlap, the shared
+        pixels count for every one of them but only once in the totals. With hist_bins, 'histogram' and
+        'zone_histograms' hold NDVI histograms over [-1, 1] that
+        green_pixels_above turns into counts for any other threshold, to
+        within the bin width.
+        progress, if given, is called as progress(done, total) after every
+        block.
+        """
+        region = self.region(shapes)
+        meta = self.region_meta(region)
+        ndvi_out = green_out = None
+        if keep_arrays:
+            ndvi_out = np.empty((region.height, region.width), dtype=np.float32)
+            green_out = np.empty((region.height, region.width), dtype=bool)
+        num_zones = 0 if shapes is None else len(shapes)
+        zones = self.zone_index(shapes)
+
+        def process_block(red_src, nir_src, window, src_window):
+            ndvi, labels = self.masked_ndvi(red_src, nir_src, src_window, shapes, zones)
+            with METRICS.span('reduce'):
+                green, valid, counts = block_counts(ndvi, labels, threshold, num_zones)
+                block = dict(counts, window=window, ndvi=ndvi, green=green)
+                if hist_bins:
+                    bins = ndvi_bins(ndvi[valid], hist_bins)
+                    block['hist'] = np.bincount(bins, minlength=hist_bins)
+                    if shapes is not None:
+                        flat = labels[:, valid].astype(np.int64) * hist_bins + bins
+                        block['zone_hist'] = np.bincount(flat.ravel(), minlength=(num_zones + 1) * hist_bins
+                                                         ).reshape(num_zones + 1, hist_bins)
+            return block
+
+        total_pixels = green_pixels = 0
+        zone_totals = np.zeros(num_zones + 1, dtype=np.int64)
+        zone_greens = np.zeros(num_zones + 1, dtype=np.int64)
+        histogram = np.zeros(hist_bins or 0, dtype=np.int64)
+        zone_hists = np.zeros((num_zones + 1, hist_bins or 0), dtype=np.int64)
+        for block in self.map_blocks(region, process_block, progress):
+            total_pixels += block['total']
+            green_pixels += block['green_total']
+            zone_totals += block['totals']
+            zone_greens += block['greens']
+            if hist_bins:
+                histogram += block['hist']
+                if shapes is not None:
+                    zone_hists += block['zone_hist']
+            if ndvi_out is not None:
+                rows, cols = block['window'].toslices()
+                ndvi_out[rows, cols] = block['ndvi']
+                green_out[rows, cols] = block['green']
+
+        stats = dict(count_stats(total_pixels, green_pixels, zone_totals, zone_greens),
+                     ndvi=ndvi_out, green_mask=green_out, meta=meta)
+        if hist_bins:
+            stats['histogram'] = histogram
+            stats['zone_histograms'] = zone_hists[1:]
+        return stats
+
+    def run_zones(self, threshold, zones, progress=None):
+        """Green and total pixel counts for every geometry in zones.
+
+        One pass over the bounding window of all zones: each block burns the
+        zones touching it into label rasters (one per layer of overlapping
+        zones) and np.bincount reduces every zone at once, so the cost
+        doesn't grow with the number of zones.
+        Returns two int64 arrays (total, green) indexed like zones.
+        """
+        try:
+            stats = self.run(threshold, zones, progress=progress)
+        except WindowError:
+            # No zone overlaps the rasters
+            return np.zeros(len(zones), dtype=np.int64), np.zeros(len(zones), dtype=np.int64)
+        return stats['zone_total_pixels'], stats['zone_green_pixels']
+
+    def map_blocks(self, region, fn, progress=None):
+        """Yield fn(red_src, nir_src, window, src_window) for every block of region.
+
+        window is relative to region and src_window to the full rasters.
+        Blocks run on the thread pool and are yielded as they finish, with a
+        bounded number in flight so memory stays flat.
+        """
+        def process(datasets, window, src_window):
+            red_src, nir_src = datasets
+            return fn(red_src, nir_src, window, src_window)
+
+        return map_region(region, self.block_size, [self.red_path, self.nir_path], process,
+                          self.num_threads, progress, self.grid)
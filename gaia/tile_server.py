@@ -0,0 +1,397 @@
+import os
+import io
+import re
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import rasterio
+from matplotlib import colormaps
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from ndvi_engine import METRICS, calculate_ndvi
+
+TILE_SIZE = 256
+NDVI_THRESHOLD = 0.3
+MAX_ZOOM = 22
+MEMORY_TILES = 4096                 # Encoded tiles kept in memory (a few KB to ~100 KB each)
+CACHE_DIR = './tile_cache'          # Disk cache; None keeps tiles in memory only
+DISK_CACHE_MB = 1024                # Disk cache cap; least recently used tiles are deleted past it
+NUM_WORKERS = 2 * (os.cpu_count() or 1)   # GDAL releases the GIL while reading and warping
+TILE_RESAMPLING = Resampling.bilinear
+WEB_MERCATOR = 'EPSG:3857'
+MERCATOR_EXTENT = 20037508.342789244
+LAYERS = ('ndvi', 'green')          # NDVI in RdYlGn; the same colors only where NDVI > threshold
+FORMATS = {'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp')}
+CMAP = colormaps['RdYlGn']
+
+# /tiles/{layer}/{z}/{x}/{y}.{fmt} and the WMTS RESTful form .../{z}/{row}/{col}.{fmt}
+XYZ_PATH = re.compile(r'^/tiles/(\w+)/(\d+)/(\d+)/(\d+)\.(\w+)$')
+WMTS_PATH = re.compile(r'^/wmts/1\.0\.0/(\w+)/default/GoogleMapsCompatible/(\d+)/(\d+)/(\d+)\.(\w+)$')
+
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (left, bottom, right, top) of XYZ tile z/x/y."""
+    size = 2 * MERCATOR_EXTENT / (1 << z)
+    left = -MERCATOR_EXTENT + x * size
+    top = MERCATOR_EXTENT - y * size
+    return left, top - size, left + size, top
+
+
+def overview_level(src, bounds):
+    """Index of the coarsest overview of src still as fine as a tile over bounds, or None for full resolution.
+
+    bounds are the tile's Web Mercator bounds; the tile's pixel size is
+    measured in the source CRS, so it accounts for Mercator's stretching
+    away from the equator.
+    """
+    factors = src.overviews(1)
+    if not factors or src.crs is None:
+        return None
+    left, bottom, right, top = transform_bounds(WEB_MERCATOR, src.crs, *bounds, densify_pts=21)
+    tile_res = min(right - left, top - bottom) / TILE_SIZE
+    level = None
+    for i, factor in enumerate(factors):
+        if max(src.res) * factor <= tile_res:
+            level = i
+    return level
+
+
+def read_tile(src, transform):
+    """One band warped onto a TILE_SIZE tile with the given transform, and its validity mask.
+
+    The VRT covers only the tile, so GDAL reads just the source blocks
+    under it. src should already be opened at the right overview level
+    (see overview_level); the warp itself reads whatever src is.
+    """
+    options = {} if src.nodata is not None else {'add_alpha': True}
+    with WarpedVRT(src, crs=WEB_MERCATOR, transform=transform, width=TILE_SIZE, height=TILE_SIZE,
+                   resampling=TILE_RESAMPLING, **options) as vrt:
+        return vrt.read(1), vrt.dataset_mask() > 0
+
+
+def colorize(ndvi, valid, layer, threshold):
+    """RGBA tile: RdYlGn over [-1, 1] like the GUI's NDVI map, transparent where invalid."""
+    rgba = CMAP((np.nan_to_num(ndvi) + 1) / 2, bytes=True)
+    # NaN compares False, so masked pixels are never green
+    shown = valid if layer == 'ndvi' else valid & (ndvi > threshold)
+    rgba[..., 3] = np.where(shown, 255, 0)
+    return rgba
+
+
+def encode(rgba, fmt):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format=FORMATS[fmt][0])
+    return buffer.getvalue()
+
+
+class TileCache:
+    """Encoded tiles in an in-memory LRU, backed by a directory of tile files.
+
+    Memory hits cost a dict lookup; disk hits are promoted into memory.
+    Files are written to a temporary name and renamed, so concurrent
+    readers never see a partial tile. The directory is capped at
+    max_disk_mb: files are tracked in least-recently-used order (seeded
+    from their mtimes when the cache opens) and the oldest are deleted
+    once a write takes it past the cap.
+    """
+
+    def __init__(self, max_tiles=MEMORY_TILES, cache_dir=None, max_disk_mb=DISK_CACHE_MB):
+        self.max_tiles = max_tiles
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.tiles = OrderedDict()
+        self.files = OrderedDict()      # path -> size, least recently used first
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        if cache_dir:
+            self.scan()
+
+    def scan(self):
+        found = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self.files[path] = size
+            self.disk_bytes += size
+        self.evict()
+
+    def path(self, key):
+        layer, threshold, z, x, y, fmt = key
+        return os.path.join(self.cache_dir, layer, 'all' if threshold is None else f"{threshold:.3f}",
+                            str(z), str(x), f"{y}.{fmt}")
+
+    def get(self, key):
+        """(data, 'memory' | 'disk') for a cached tile, or (None, None)."""
+        with self.lock:
+            data = self.tiles.get(key)
+            if data is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return data, 'memory'
+        if self.cache_dir:
+            try:
+                with open(self.path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                self.remember(key, data)
+                with self.lock:
+                    self.disk_hits += 1
+                    if self.path(key) in self.files:
+                        self.files.move_to_end(self.path(key))
+                return data, 'disk'
+        with self.lock:
+            self.misses += 1
+        return None, None
+
+    def put(self, key, data):
+        self.remember(key, data)
+        if self.cache_dir:
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            with self.lock:
+                self.disk_bytes += len(data) - self.files.pop(path, 0)
+                self.files[path] = len(data)
+                self.evict()
+
+    def evict(self):
+        # Caller holds self.lock (or is the constructor)
+        while self.disk_bytes > self.max_disk_bytes and self.files:
+            path, size = self.files.popitem(last=False)
+            self.disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def remember(self, key, data):
+        with self.lock:
+            self.tiles[key] = data
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'memory_hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'memory_tiles': len(self.tiles), 'disk_tiles': len(self.files),
+                    'disk_bytes': self.disk_bytes, 'evictions': self.evictions}
+
+
+class TileRenderer:
+    """NDVI and green cover tiles rendered on demand from a red/NIR pair.
+
+    Both bands are warped straight onto each tile's Web Mercator grid, so
+    they line up even when their own grids differ, and NDVI uses the same
+    calculate_ndvi as NDVIEngine. Each band is read from its coarsest
+    overview that still matches the tile's resolution, so zoomed-out
+    tiles don't pull full-resolution blocks. Every thread keeps its own
+    dataset handles, one per band and overview level. Tiles are cached under a token of the source paths, sizes
+    and mtimes, so changed rasters never serve stale tiles. Concurrent
+    requests for a tile that isn't cached yet wait for one render.
+    """
+
+    def __init__(self, red_path, nir_path, cache_dir=CACHE_DIR, memory_tiles=MEMORY_TILES,
+                 disk_cache_mb=DISK_CACHE_MB):
+        self.paths = [os.path.abspath(red_path), os.path.abspath(nir_path)]
+        with rasterio.open(red_path) as src:
+            self.bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds, densify_pts=21)
+        token = hashlib.sha1(repr([(path, os.stat(path).st_size, os.stat(path).st_mtime)
+                                   for path in self.paths]).encode()).hexdigest()[:12]
+        self.cache = TileCache(memory_tiles, cache_dir and os.path.join(cache_dir, token), disk_cache_mb)
+        self.local = threading.local()
+        self.opened = []
+        self.rendering = {}             # key -> Future of the render in flight
+        self.lock = threading.Lock()
+
+    def dataset(self, path, level=None):
+        """This thread's handle on path, opened at overview level (None: full resolution)."""
+        if not hasattr(self.local, 'datasets'):
+            self.local.datasets = {}
+        dataset = self.local.datasets.get((path, level))
+        if dataset is None:
+            dataset = rasterio.open(path) if level is None else rasterio.open(path, overview_level=level)
+            self.local.datasets[(path, level)] = dataset
+            with self.lock:
+                self.opened.append(dataset)
+        return dataset
+
+    def datasets(self, bounds):
+        """Handles on both bands at the overview level that suits a tile over bounds."""
+        datasets = []
+        for path in self.paths:
+            src = self.dataset(path)
+            datasets.append(self.dataset(path, overview_level(src, bounds)))
+        return datasets
+
+    def tile(self, layer, z, x, y, fmt='png', threshold=NDVI_THRESHOLD):
+        """Encoded tile and where it came from ('memory', 'disk', 'render' or 'shared')."""
+        # Thresholds are resolved to 0.001, the same resolution as the GUI's histograms
+        key = (layer, None if layer == 'ndvi' else round(threshold, 3), z, x, y, fmt)
+        data, source = self.cache.get(key)
+        if data is not None:
+            return data, source
+        # The first request for a missing tile renders it; the rest wait for that result
+        with self.lock:
+            future = self.rendering.get(key)
+            rendering = future is None
+            if rendering:
+                future = self.rendering[key] = Future()
+        if not rendering:
+            return future.result(), 'shared'
+        try:
+            data = self.render(layer, z, x, y, fmt, key[1])
+            self.cache.put(key, data)
+            future.set_result(data)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.rendering[key]
+        return data, 'render'
+
+    def render(self, layer, z, x, y, fmt, threshold):
+        left, bottom, right, top = tile_bounds(z, x, y)
+        west, south, east, north = self.bounds
+        if right <= west or left >= east or top <= south or bottom >= north:
+            return encode(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8), fmt)
+        transform = from_bounds(left, bottom, right, top, TILE_SIZE, TILE_SIZE)
+        red_src, nir_src = self.datasets((left, bottom, right, top))
+        red, red_valid = read_tile(red_src, transform)
+        nir, nir_valid = read_tile(nir_src, transform)
+        return encode(colorize(calculate_ndvi(red, nir), red_valid & nir_valid, layer, threshold), fmt)
+
+    def close(self):
+        with self.lock:
+            for dataset in self.opened:
+                dataset.close()
+            self.opened = []
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer handling requests on a fixed pool of worker threads."""
+
+    def __init__(self, address, handler, renderer, num_workers=NUM_WORKERS):
+        super().__init__(address, handler)
+        self.renderer = renderer
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+        self.renderer.close()
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.send(200, 'application/json', json.dumps(self.server.renderer.cache.stats()).encode())
+            return
+        match = XYZ_PATH.match(url.path)
+        if match:
+            layer, z, x, y, fmt = match.groups()
+        else:
+            match = WMTS_PATH.match(url.path)
+            if not match:
+                self.send_error(404, "Use /tiles/{layer}/{z}/{x}/{y}.png")
+                return
+            layer, z, y, x, fmt = match.groups()
+        z, x, y = int(z), int(x), int(y)
+        if layer not in LAYERS or fmt not in FORMATS or z > MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+            self.send_error(404, "Unknown layer, format or tile")
+            return
+        try:
+            threshold = float(parse_qs(url.query).get('threshold', [NDVI_THRESHOLD])[0])
+        except ValueError:
+            self.send_error(400, "threshold must be a number")
+            return
+        try:
+            data, source = self.server.renderer.tile(layer, z, x, y, fmt, min(max(threshold, -1.0), 1.0))
+        except Exception as e:
+            print(f"[!] Error rendering {layer} {z}/{x}/{y}: {e}")
+            self.send_error(500, str(e))
+            return
+        self.send(200, FORMATS[fmt][1], data, {'X-Tile-Cache': source})
+
+    def send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'max-age=3600')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per tile would drown the console
+        pass
+
+
+def serve(red_path, nir_path, host='127.0.0.1', port=8000, cache_dir=CACHE_DIR,
+          memory_tiles=MEMORY_TILES, num_workers=NUM_WORKERS, disk_cache_mb=DISK_CACHE_MB):
+    renderer = TileRenderer(red_path, nir_path, cache_dir, memory_tiles, disk_cache_mb)
+    server = PooledHTTPServer((host, port), TileHandler, renderer, num_workers)
+    METRICS.event(f"Serving http://{host}:{port}/tiles/{{ndvi|green}}/{{z}}/{{x}}/{{y}}.png?threshold="
+                  f"{NDVI_THRESHOLD} on {num_workers} workers", host=host, port=port, workers=num_workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local XYZ/WMTS tile server for NDVI and green cover layers.")
+    parser.add_argument('red', help="Red band raster")
+    parser.add_argument('nir', help="NIR band raster")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Disk tile cache ('' to disable)")
+    parser.add_argument('--memory-tiles', type=int, default=MEMORY_TILES, help="Tiles kept in memory")
+    parser.add_argument('--disk-cache-mb', type=int, default=DISK_CACHE_MB, help="Disk tile cache size cap")
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS, help="Request worker threads")
+    args = parser.parse_args(argv)
+    METRICS.configure(echo=True)
+    serve(args.red, args.nir, args.host, args.port, args.cache_dir or None, args.memory_tiles, args.workers,
+          args.disk_cache_mb)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import json
+import time
+import functools
+import threading
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, q):
+    """q-th percentile of sorted values, interpolating linearly like numpy's default."""
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class NullSpan:
+    """Stands in for spans and scenes while metrics are disabled."""
+
+    record = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, **counts):
+        pass
+
+    def set(self, **fields):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ('metrics', 'name', 'counts', 'start')
+
+    def __init__(self, metrics, name, counts):
+        self.metrics = metrics
+        self.name = name
+        self.counts = counts
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record_span(self.name, time.perf_counter() - self.start, self.counts)
+        return False
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+
+class Scene:
+    """Collects the spans of one unit of work (a scene) into a single record.
+
+    A scene can be entered more than once, e.g. around a batch extraction
+    and later around the processing; seconds add up over every entry.
+    """
+
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.record = {'type': 'scene', 'scene': name, **fields, 'seconds': 0.0, 'spans': {}, 'counts': {}}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.previous = self.metrics.current
+        self.metrics.current = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record['seconds'] += time.perf_counter() - self.start
+        if exc_type is not None:
+            self.record.setdefault('status', 'failed')
+            self.record['error'] = str(exc)
+        self.metrics.current = self.previous
+        return False
+
+    def add(self, **counts):
+        with self.metrics.lock:
+            counts_so_far = self.record['counts']
+            for name, value in counts.items():
+                counts_so_far[name] = counts_so_far.get(name, 0) + value
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+
+class Metrics:
+    """Timing spans, per-scene JSON-lines records and run summaries for poseidon and gaia.
+
+    Wrap work in span(name) (or decorate it with timed(name)); every span
+    that closes inside a scene() adds its duration and counts to that
+    scene's record. add_record() emits a finished record: it is appended
+    to path as a JSON line, echoed as a [DEBUG] line if echo is set, and
+    kept for summary(). Records are plain dicts, so worker processes can
+    return them to the parent instead of writing themselves. Spans from
+    worker threads add up, so a scene's span seconds can exceed its wall
+    time. While disabled, span() and scene() return a shared no-op object.
+    configure() starts a new run: records kept from an earlier run in the
+    same process are dropped, so summary() only covers this one.
+    """
+
+    def __init__(self, path=None, enabled=True, echo=False):
+        self.path = path
+        self.enabled = enabled
+        self.echo = echo
+        self.lock = threading.Lock()
+        self.current = None
+        self.records = []
+
+    def configure(self, path=None, enabled=True, echo=False):
+        self.path = path
+        self.enabled = enabled
+        self.echo = echo
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.current = None
+            self.records = []
+
+    def span(self, name, **counts):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, counts)
+
+    def timed(self, name=None):
+        """Decorator running the function inside span(name), the function's name by default."""
+        def decorator(fn):
+            span_name = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with Span(self, span_name, {}):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def scene(self, name, **fields):
+        if not self.enabled:
+            return NULL_SPAN
+        return Scene(self, name, fields)
+
+    def record_span(self, name, seconds, counts):
+        scene = self.current
+        if scene is None:
+            return
+        with self.lock:
+            spans = scene.record['spans']
+            spans[name] = spans.get(name, 0.0) + seconds
+            scene_counts = scene.record['counts']
+            for count, value in counts.items():
+                scene_counts[count] = scene_counts.get(count, 0) + value
+
+    def add_record(self, record):
+        """Emit a finished scene record (None, from a disabled worker, is ignored)."""
+        if record is None or not self.enabled:
+            return
+        with self.lock:
+            self.records.append(record)
+        self.write(record)
+        if self.echo:
+            counts = ", ".join(f"{name} {value}" for name, value in record['counts'].items())
+            spans = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in record['spans'].items())
+            print(f"[DEBUG] Scene {record['scene']}: {record['seconds']:.2f}s"
+                  f"{' (' + spans + ')' if spans else ''}{'; ' + counts if counts else ''}")
+
+    def event(self, message, **fields):
+        """A one-off run event (e.g. 'Found 12 TIFF files'), written and echoed like a record."""
+        if not self.enabled:
+            return
+        self.write({'type': 'event', 'message': message, **fields})
+        if self.echo:
+            print(f"[DEBUG] {message}")
+
+    def write(self, record):
+        if not self.path:
+            return
+        line = json.dumps(dict(record, time=time.time()), default=str) + "\n"
+        with self.lock, open(self.path, 'a') as f:
+            f.write(line)
+
+    def summary(self):
+        """Percentiles of scene and span seconds, and totals of every count, over the records so far."""
+        with self.lock:
+            records = list(self.records)
+        seconds = {'scene': [record['seconds'] for record in records]}
+        totals = {}
+        for record in records:
+            for name, value in record['spans'].items():
+                seconds.setdefault(name, []).append(value)
+            for name, value in record['counts'].items():
+                totals[name] = totals.get(name, 0) + value
+        stats = {}
+        for name, values in seconds.items():
+            if not values:
+                continue
+            values = sorted(values)
+            stats[name] = {'count': len(values), 'total': sum(values), 'max': values[-1],
+                           **{f"p{q}": percentile(values, q) for q in PERCENTILES}}
+        return {'type': 'summary', 'scenes': len(records),
+                'failed': sum(record.get('status') == 'failed' for record in records),
+                'seconds': stats, 'counts': totals}
+
+    def report(self):
+        """Write the summary as the run's last JSON line and print it as a table."""
+        if not self.enabled:
+            return None
+        summary = self.summary()
+        self.write(summary)
+        print(f"[DEBUG] {summary['scenes']} scenes, {summary['failed']} failed")
+        for name, stats in summary['seconds'].items():
+            percentiles = " ".join(f"p{q} {stats[f'p{q}']:.3f}s" for q in PERCENTILES)
+            print(f"[DEBUG]   {name:<10} n={stats['count']:<6} total {stats['total']:.2f}s  "
+                  f"{percentiles}  max {stats['max']:.3f}s")
+        for name, value in summary['counts'].items():
+            print(f"[DEBUG]   {name}: {value}")
+        return summary
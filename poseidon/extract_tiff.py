@@ -1,116 +1,505 @@
 import os
+import time
+import argparse
 import zipfile
 import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import rasterio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
 import cv2
 from tqdm import tqdm
+from manifest import IngestManifest
+from shards import PatchShardWriter
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from spectral import SpectralKernel, normalized_difference
+from metrics import Metrics
+from catalog import SceneCatalog, members_by_zip
 
 # Configurations
 ZIP_DIR = 'zips'            # Folder containing your zip files
 TEMP_UNZIP_DIR = './temp_unzip'
 OUTPUT_DIR = './water_patches'
 PATCH_SIZE = 128
+PATCH_STRIDE = 128          # Step between patch origins; < PATCH_SIZE gives overlapping patches
 NDWI_THRESHOLD = 0.2
 BATCH_SIZE = 3              # Process 3 .tif files at a time
+READ_MODE = 'vsizip'        # 'vsizip' / 'memory' read members in place, 'extract' unzips to TEMP_UNZIP_DIR
+ENGINE = 'windowed'         # 'windowed' reads WINDOW_SIZE blocks, 'full' reads whole bands
+WINDOW_SIZE = 1024          # Rounded down to a multiple of PATCH_STRIDE
+NUM_WORKERS = os.cpu_count() or 1   # Scene worker processes; 1 runs everything in this process
+WORKER_MEMORY_MB = 2048     # Raster memory budget per worker
+BYTES_PER_PIXEL = 24        # Rough peak per pixel: green/NIR/RGB reads, NDWI temporaries, mask
+OUTPUT_FORMAT = 'jpg'       # 'jpg' writes one file per patch, 'npy' appends to shards in OUTPUT_DIR
+SHARD_SIZE = 1024           # Patches per .npy shard
+MANIFEST_PATH = './ingest_manifest.sqlite'  # Completed members are skipped on re-runs; None disables
+METRICS_ENABLED = True      # Per-scene span timings and an end-of-run summary from process_all_zips
+METRICS_PATH = None         # JSON-lines file the scene records and summary are appended to
+CATALOG_PATH = './scene_catalog.sqlite'     # Scene footprints, used when an AOI/date filter is given
 
 # Ensure directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-if os.path.exists(TEMP_UNZIP_DIR):
-    shutil.rmtree(TEMP_UNZIP_DIR)
-os.makedirs(TEMP_UNZIP_DIR, exist_ok=True)
+
+# Spans are no-ops until process_all_zips (or a worker initializer) enables them
+METRICS = Metrics(enabled=False)
+
+def make_temp_dir():
+    # A fresh directory per batch/scene, so parallel workers and runs never share one
+    os.makedirs(TEMP_UNZIP_DIR, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"worker{os.getpid()}_", dir=TEMP_UNZIP_DIR)
+
+def window_size_for_budget(memory_mb):
+    side = int(np.sqrt(memory_mb * 1e6 / BYTES_PER_PIXEL))
+    return max(PATCH_STRIDE, side // PATCH_STRIDE * PATCH_STRIDE)
+
+def scene_fits_budget(tiff_path):
+    try:
+        with rasterio.open(tiff_path) as src:
+            return src.width * src.height * BYTES_PER_PIXEL <= WORKER_MEMORY_MB * 1e6
+    except Exception:
+        # Let the engine report the open error
+        return True
+
+NDWI_EPSILON = 1e-5
 
 def calculate_ndwi(green, nir):
-    return (green.astype(np.float32) - nir.astype(np.float32)) / (green + nir + 1e-5)
+    # Sums in float32, so uint16 green + nir can't wrap around
+    return normalized_difference(green, nir, eps=NDWI_EPSILON)
+
+def water_tile_counts(water_mask, stride=None):
+    """Number of water pixels in every PATCH_SIZE tile of water_mask.
+
+    Entry [i, j] is the tile whose top-left corner is (j * stride, i * stride),
+    covering the same origins as the old nested range() loops. All tiles are
+    reduced at once: a reshape + sum for non-overlapping tiles, a summed-area
+    table for overlapping strides.
+    """
+    stride = stride or PATCH_STRIDE
+    h, w = water_mask.shape
+    if h < PATCH_SIZE or w < PATCH_SIZE:
+        return np.zeros((0, 0), dtype=np.int64)
+    if stride == PATCH_SIZE:
+        ny, nx = h // PATCH_SIZE, w // PATCH_SIZE
+        blocks = water_mask[:ny * PATCH_SIZE, :nx * PATCH_SIZE].reshape(ny, PATCH_SIZE, nx, PATCH_SIZE)
+        counts = blocks.sum(axis=(1, 3))
+    else:
+        integral = np.zeros((h + 1, w + 1), dtype=np.int32)
+        np.cumsum(water_mask, axis=0, dtype=np.int32, out=integral[1:, 1:])
+        np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+        y0 = np.arange(0, h - PATCH_SIZE + 1, stride)[:, None]
+        x0 = np.arange(0, w - PATCH_SIZE + 1, stride)[None, :]
+        y1, x1 = y0 + PATCH_SIZE, x0 + PATCH_SIZE
+        counts = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return counts
+
+def select_water_tiles(water_mask, stride=None):
+    """Boolean grid of the PATCH_SIZE tiles that are more than half water."""
+    # Integer count against half the tile is exactly np.mean(tile) > 0.5
+    return water_tile_counts(water_mask, stride) > 0.5 * PATCH_SIZE * PATCH_SIZE
+
+def save_patch(tiff_path, patch, x, y):
+    # Normalize patch to 0-255
+    patch = cv2.normalize(patch, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    out_name = f"{os.path.splitext(os.path.basename(tiff_path))[0]}_{x}_{y}.jpg"
+    out_path = os.path.join(OUTPUT_DIR, out_name)
+    cv2.imwrite(out_path, patch)
+
+class JpegPatchWriter:
+    """One normalized JPEG per patch in OUTPUT_DIR, the original output layout."""
+
+    def __init__(self, tiff_path):
+        self.tiff_path = tiff_path
+
+    def add(self, patch, x, y, water_fraction):
+        save_patch(self.tiff_path, patch, x, y)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+def open_patch_writer(tiff_path, dtype):
+    if OUTPUT_FORMAT == 'npy':
+        scene = os.path.splitext(os.path.basename(tiff_path))[0]
+        return PatchShardWriter(OUTPUT_DIR, scene, PATCH_SIZE, dtype, SHARD_SIZE)
+    return JpegPatchWriter(tiff_path)
 
 def extract_water_patches(tiff_path):
-    print(f"[DEBUG] Processing TIFF: {tiff_path}")
+    if ENGINE == 'full':
+        if scene_fits_budget(tiff_path):
+            return extract_water_patches_full(tiff_path)
+        METRICS.event(f"{tiff_path} exceeds WORKER_MEMORY_MB, using windowed engine", path=tiff_path)
+    return extract_water_patches_windowed(tiff_path)
+
+def extract_water_patches_full(tiff_path):
     try:
         with rasterio.open(tiff_path) as src:
             # Check if there are at least 8 bands
             if src.count < 8:
                 print(f"[!] Not enough bands in {tiff_path}. Skipping.")
-                return
-            green = src.read(3)
-            nir = src.read(8)
-            # Assume RGB from bands 4, 3, 2
-            rgb = np.stack([src.read(4), src.read(3), src.read(2)], axis=-1)
+                return 0
+            with METRICS.span('read'):
+                green = src.read(3)
+                nir = src.read(8)
+                # Assume RGB from bands 4, 3, 2
+                rgb = np.stack([src.read(4), src.read(3), src.read(2)], axis=-1)
     except Exception as e:
         print(f"[!] Error opening {tiff_path}: {e}")
-        return
+        return None
+
+    with METRICS.span('ndwi', pixels=green.size):
+        ndwi = calculate_ndwi(green, nir)
+        water_mask = ndwi > NDWI_THRESHOLD
+    with METRICS.span('select'):
+        counts = water_tile_counts(water_mask)
+        origins = list(zip(*np.nonzero(counts > 0.5 * PATCH_SIZE * PATCH_SIZE)))
+
+    patch_count = 0
+    with METRICS.span('write'), open_patch_writer(tiff_path, rgb.dtype) as writer:
+        for iy, ix in origins:
+            y, x = int(iy) * PATCH_STRIDE, int(ix) * PATCH_STRIDE
+            writer.add(rgb[y:y+PATCH_SIZE, x:x+PATCH_SIZE, :], x, y,
+                       counts[iy, ix] / (PATCH_SIZE * PATCH_SIZE))
+            patch_count += 1
+    return patch_count
 
-    ndwi = calculate_ndwi(green, nir)
-    water_mask = ndwi > NDWI_THRESHOLD
+def extract_water_patches_windowed(tiff_path):
+    """Same patches as extract_water_patches_full, in memory bounded by WINDOW_SIZE.
 
-    h, w = ndwi.shape
+    Green and NIR are read one stride-aligned window at a time, and the
+    RGB bands are only read for the patches that pass the water test.
+    Windows overlap by PATCH_SIZE - PATCH_STRIDE so every patch origin falls
+    in exactly one window.
+    """
+    window_size = max(PATCH_STRIDE, WINDOW_SIZE // PATCH_STRIDE * PATCH_STRIDE)
+    overlap = PATCH_SIZE - PATCH_STRIDE
     patch_count = 0
-    for y in range(0, h - PATCH_SIZE + 1, PATCH_SIZE):
-        for x in range(0, w - PATCH_SIZE + 1, PATCH_SIZE):
-            window = water_mask[y:y+PATCH_SIZE, x:x+PATCH_SIZE]
-            if np.mean(window) > 0.5:
-                patch = rgb[y:y+PATCH_SIZE, x:x+PATCH_SIZE, :]
-                if patch.shape == (PATCH_SIZE, PATCH_SIZE, 3):
-                    # Normalize patch to 0-255
-                    patch = cv2.normalize(patch, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-                    out_name = f"{os.path.splitext(os.path.basename(tiff_path))[0]}_{x}_{y}.jpg"
-                    out_path = os.path.join(OUTPUT_DIR, out_name)
-                    cv2.imwrite(out_path, patch)
-                    patch_count += 1
-    print(f"[DEBUG] Generated {patch_count} patches from {os.path.basename(tiff_path)}")
-
-def process_zip_in_batches(zip_path):
-    print(f"\n[DEBUG] Processing ZIP: {zip_path}")
+    try:
+        with rasterio.open(tiff_path) as src:
+            # Check if there are at least 8 bands
+            if src.count < 8:
+                print(f"[!] Not enough bands in {tiff_path}. Skipping.")
+                return 0
+            h, w = src.height, src.width
+            # One set of NDWI buffers for every window of the scene
+            kernel = SpectralKernel((window_size + overlap, window_size + overlap), ['NDWI'], eps=NDWI_EPSILON)
+            with open_patch_writer(tiff_path, src.dtypes[3]) as writer:
+                for wy in range(0, h - PATCH_SIZE + 1, window_size):
+                    for wx in range(0, w - PATCH_SIZE + 1, window_size):
+                        win = Window(wx, wy, min(window_size + overlap, w - wx),
+                                     min(window_size + overlap, h - wy))
+                        with METRICS.span('read'):
+                            green = src.read(3, window=win)
+                            nir = src.read(8, window=win)
+                        with METRICS.span('ndwi', pixels=green.size):
+                            ndwi = kernel.compute({'green': green, 'nir': nir})['NDWI']
+                            water_mask = ndwi > NDWI_THRESHOLD
+                        with METRICS.span('select'):
+                            counts = water_tile_counts(water_mask)
+                            origins = list(zip(*np.nonzero(counts > 0.5 * PATCH_SIZE * PATCH_SIZE)))
+
+                        for iy, ix in origins:
+                            y = wy + int(iy) * PATCH_STRIDE
+                            x = wx + int(ix) * PATCH_STRIDE
+                            # Assume RGB from bands 4, 3, 2
+                            patch_win = Window(x, y, PATCH_SIZE, PATCH_SIZE)
+                            with METRICS.span('read'):
+                                patch = np.moveaxis(src.read([4, 3, 2], window=patch_win), 0, -1)
+                            with METRICS.span('write'):
+                                writer.add(patch, x, y, counts[iy, ix] / (PATCH_SIZE * PATCH_SIZE))
+                            patch_count += 1
+    except Exception as e:
+        print(f"[!] Error processing {tiff_path}: {e}")
+        return None
+    return patch_count
+
+def process_zip_in_batches(zip_path, manifest=None, members=None):
+    METRICS.event(f"Processing ZIP: {zip_path}", zip=zip_path)
+    tif_infos = list_tif_infos(zip_path, manifest, members)
     with zipfile.ZipFile(zip_path, 'r') as zf:
-        # Get list of all TIFF files in the zip (using infolist)
-        tif_members = [info.filename for info in zf.infolist() if info.filename.lower().endswith('.tif')]
-        print(f"[DEBUG] Found {len(tif_members)} TIFF files in {os.path.basename(zip_path)}")
-        
         # Process in batches of BATCH_SIZE TIFF files
-        for i in range(0, len(tif_members), BATCH_SIZE):
-            batch = tif_members[i:i+BATCH_SIZE]
-            print(f"[DEBUG] Processing batch: {batch}")
+        for i in range(0, len(tif_infos), BATCH_SIZE):
+            batch = tif_infos[i:i+BATCH_SIZE]
+            METRICS.event(f"Processing batch: {[info.filename for info in batch]}")
             
-            # Ensure TEMP_UNZIP_DIR is clean
-            if os.path.exists(TEMP_UNZIP_DIR):
-                shutil.rmtree(TEMP_UNZIP_DIR)
-            os.makedirs(TEMP_UNZIP_DIR, exist_ok=True)
+            # Fresh temp directory for this batch
+            temp_dir = make_temp_dir()
             
             # Extract only the files in the current batch
-            for member in batch:
+            extract_times = {}
+            scenes = {info.filename: open_scene(zip_path, info.filename) for info in batch}
+            for info in batch:
+                start = time.perf_counter()
                 try:
-                    zf.extract(member, TEMP_UNZIP_DIR)
-                    print(f"[DEBUG] Extracted {member}")
+                    with scenes[info.filename], METRICS.span('extract'):
+                        zf.extract(info, temp_dir)
                 except Exception as e:
-                    print(f"[!] Error extracting {member}: {e}")
+                    print(f"[!] Error extracting {info.filename}: {e}")
+                finally:
+                    # Recorded on failure too: a partial file may still be left to process
+                    extract_times[info.filename] = time.perf_counter() - start
             
             # Process each extracted TIFF file
-            for member in batch:
-                tiff_path = os.path.join(TEMP_UNZIP_DIR, member)
+            for info in batch:
+                member = info.filename
+                tiff_path = os.path.join(temp_dir, member)
                 if os.path.exists(tiff_path):
-                    extract_water_patches(tiff_path)
+                    start = time.perf_counter()
+                    with scenes[member]:
+                        patch_count = extract_water_patches(tiff_path)
+                    elapsed = extract_times[member] + time.perf_counter() - start
+                    # Archive read + temp file written + temp file read back
+                    close_scene(scenes[member], patch_count, info.compress_size + 2 * info.file_size)
+                    report_scene(member, patch_count, scenes[member].record)
+                    record_scene(manifest, zip_path, info, patch_count, elapsed)
                     try:
                         os.remove(tiff_path)
-                        print(f"[DEBUG] Deleted {tiff_path}")
                     except Exception as e:
                         print(f"[!] Could not delete {tiff_path}: {e}")
                 else:
                     print(f"[!] File not found: {tiff_path}")
+                    record_scene(manifest, zip_path, info, None)
             
-            # Cleanup TEMP_UNZIP_DIR for this batch
-            if os.path.exists(TEMP_UNZIP_DIR):
-                shutil.rmtree(TEMP_UNZIP_DIR)
-                os.makedirs(TEMP_UNZIP_DIR, exist_ok=True)
+            # Cleanup the temp directory for this batch
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    finish_zip(manifest, zip_path)
 
-def process_all_zips():
-    zip_files = [f for f in os.listdir(ZIP_DIR) if f.lower().endswith('.zip')]
-    print(f"[DEBUG] Total ZIP files in '{ZIP_DIR}': {len(zip_files)}")
-    for zipf in tqdm(zip_files, desc="Processing ZIP files"):
-        zip_path = os.path.join(ZIP_DIR, zipf)
+def open_scene(zip_path, member):
+    return METRICS.scene(os.path.basename(member), zip=os.path.basename(zip_path), read_mode=READ_MODE,
+                         engine=ENGINE)
+
+def close_scene(scene, patch_count, bytes_read):
+    scene.set(status='failed' if patch_count is None else 'done')
+    scene.add(patches=patch_count or 0, bytes_read=bytes_read)
+
+def report_scene(member, patch_count, record):
+    if patch_count is None:
+        print(f"[!] Scene {os.path.basename(member)} failed")
+    METRICS.add_record(record)
+
+def record_scene(manifest, zip_path, info, patch_count, elapsed=None):
+    # Engines return None when a scene could not be read or processed
+    if manifest is not None:
+        status = 'failed' if patch_count is None else 'done'
+        manifest.record(zip_path, info, status, patch_count, elapsed)
+
+def finish_zip(manifest, zip_path):
+    if manifest is not None:
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            infos = [info for info in zf.infolist() if info.filename.lower().endswith('.tif')]
+        manifest.finish_zip(zip_path, infos)
+
+def process_scene(zip_path, member):
+    """Run one .tif member of zip_path through extract_water_patches using READ_MODE.
+
+    Returns (patch_count, bytes_read, elapsed); patch_count is None if the
+    scene failed.
+    """
+    start = time.perf_counter()
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        info = zf.getinfo(member)
+        if READ_MODE == 'extract':
+            temp_dir = make_temp_dir()
+            try:
+                with METRICS.span('extract'):
+                    tiff_path = zf.extract(member, temp_dir)
+                patch_count = extract_water_patches(tiff_path)
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            # Archive read + temp file written + temp file read back
+            bytes_read = info.compress_size + 2 * info.file_size
+        elif READ_MODE == 'memory':
+            with METRICS.span('extract'):
+                data = zf.read(member)
+            with MemoryFile(data, filename=os.path.basename(member)) as memfile:
+                patch_count = extract_water_patches(memfile.name)
+            del data
+            bytes_read = info.compress_size
+        else:
+            vsi_path = f"/vsizip/{os.path.abspath(zip_path)}/{member}"
+            patch_count = extract_water_patches(vsi_path)
+            # Only the compressed member is read from disk; nothing is written
+            bytes_read = info.compress_size
+    return patch_count, bytes_read, time.perf_counter() - start
+
+def measure_scene(zip_path, member):
+    """process_scene inside a metrics scene; returns its result and the scene record.
+
+    The record is a plain dict (None while metrics are disabled), so pool
+    workers hand it back to the parent, which writes and summarizes it.
+    """
+    with open_scene(zip_path, member) as scene:
+        patch_count, bytes_read, elapsed = process_scene(zip_path, member)
+        close_scene(scene, patch_count, bytes_read)
+    return (patch_count, bytes_read, elapsed), scene.record
+
+def process_zip_streaming(zip_path, manifest=None, members=None):
+    """Read .tif members in place without writing anything to TEMP_UNZIP_DIR.
+
+    'vsizip' lets GDAL seek inside the archive and only decode the blocks it
+    needs, 'memory' inflates one member into RAM and hands it to GDAL through
+    /vsimem/.
+    """
+    METRICS.event(f"Streaming ZIP ({READ_MODE}): {zip_path}", zip=zip_path)
+    total_bytes = 0
+    total_time = 0.0
+    for info in list_tif_infos(zip_path, manifest, members):
         try:
-            process_zip_in_batches(zip_path)
-        except zipfile.BadZipFile:
-            print(f"[!] Corrupt ZIP file: {zipf}")
+            (patch_count, bytes_read, elapsed), record = measure_scene(zip_path, info.filename)
+        except Exception as e:
+            print(f"[!] Error reading {info.filename}: {e}")
+            record_scene(manifest, zip_path, info, None)
             continue
+        report_scene(info.filename, patch_count, record)
+        record_scene(manifest, zip_path, info, patch_count, elapsed)
+        total_bytes += bytes_read
+        total_time += elapsed
+    finish_zip(manifest, zip_path)
+
+    METRICS.event(f"ZIP {os.path.basename(zip_path)}: {total_bytes / 1e6:.1f} MB read in {total_time:.2f}s",
+                  zip=zip_path, bytes_read=total_bytes, seconds=total_time)
+
+def list_tif_infos(zip_path, manifest=None, members=None):
+    """.tif members of zip_path, limited to members[zip_path] (from the catalog) when members is given."""
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        tif_infos = [info for info in zf.infolist() if info.filename.lower().endswith('.tif')]
+    METRICS.event(f"Found {len(tif_infos)} TIFF files in {os.path.basename(zip_path)}", zip=zip_path)
+    if members is not None:
+        selected = members.get(os.path.abspath(zip_path), set())
+        tif_infos = [info for info in tif_infos if info.filename in selected]
+        METRICS.event(f"{len(tif_infos)} of them match the AOI/date filter", zip=zip_path)
+    if manifest is not None:
+        pending = manifest.pending_members(zip_path, tif_infos)
+        METRICS.event(f"{len(tif_infos) - len(pending)} already complete, {len(pending)} to process",
+                      zip=zip_path)
+        tif_infos = pending
+    return tif_infos
+
+def process_zip(zip_path, manifest=None, members=None):
+    if READ_MODE == 'extract':
+        process_zip_in_batches(zip_path, manifest, members)
+    else:
+        process_zip_streaming(zip_path, manifest, members)
+
+def init_worker(config):
+    # Workers may be spawned rather than forked, so carry the parent's settings over
+    globals().update(config)
+    global WINDOW_SIZE
+    WINDOW_SIZE = min(WINDOW_SIZE, window_size_for_budget(WORKER_MEMORY_MB))
+    # Workers only build records; the parent writes and echoes them
+    METRICS.configure(enabled=METRICS_ENABLED)
+
+def worker_config():
+    return {name: globals()[name] for name in (
+        'TEMP_UNZIP_DIR', 'OUTPUT_DIR', 'PATCH_SIZE', 'PATCH_STRIDE', 'NDWI_THRESHOLD',
+        'READ_MODE', 'ENGINE', 'WINDOW_SIZE', 'WORKER_MEMORY_MB', 'BYTES_PER_PIXEL',
+        'OUTPUT_FORMAT', 'SHARD_SIZE', 'METRICS_ENABLED')}
+
+def process_scenes_parallel(zip_paths, num_workers, manifest=None, members=None):
+    """Spread every .tif member of every ZIP over a pool of num_workers processes."""
+    scenes = []
+    for zip_path in zip_paths:
+        try:
+            scenes.extend((zip_path, info) for info in list_tif_infos(zip_path, manifest, members))
+        except zipfile.BadZipFile:
+            print(f"[!] Corrupt ZIP file: {os.path.basename(zip_path)}")
+    METRICS.event(f"Scheduling {len(scenes)} scenes on {num_workers} workers")
+
+    total_patches = 0
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                             initargs=(worker_config(),)) as pool:
+        futures = {pool.submit(measure_scene, zip_path, info.filename): (zip_path, info)
+                   for zip_path, info in scenes}
+        with tqdm(total=len(futures), desc="Processing scenes") as progress:
+            for future in as_completed(futures):
+                zip_path, info = futures[future]
+                try:
+                    (patch_count, bytes_read, elapsed), record = future.result()
+                    report_scene(info.filename, patch_count, record)
+                    record_scene(manifest, zip_path, info, patch_count, elapsed)
+                    total_patches += patch_count or 0
+                except Exception as e:
+                    print(f"[!] Error processing {info.filename}: {e}")
+                    record_scene(manifest, zip_path, info, None)
+                progress.update(1)
+                progress.set_postfix(patches=total_patches)
+
+    for zip_path in sorted({zip_path for zip_path, _ in scenes}):
+        finish_zip(manifest, zip_path)
+
+def open_manifest():
+    if not MANIFEST_PATH:
+        return None
+    params = {'PATCH_SIZE': PATCH_SIZE, 'PATCH_STRIDE': PATCH_STRIDE,
+              'NDWI_THRESHOLD': NDWI_THRESHOLD, 'OUTPUT_DIR': os.path.abspath(OUTPUT_DIR),
+              'OUTPUT_FORMAT': OUTPUT_FORMAT}
+    return IngestManifest(MANIFEST_PATH, params)
+
+def catalog_members(aoi=None, start=None, end=None):
+    """{zip_path: member names} of the scenes in ZIP_DIR intersecting aoi and dated within [start, end].
+
+    The catalog at CATALOG_PATH is brought up to date first; only new or
+    changed ZIPs have their member headers read.
+    """
+    catalog = SceneCatalog(CATALOG_PATH)
+    try:
+        added, removed = catalog.update(ZIP_DIR)
+        METRICS.event(f"Catalog updated: {added} scenes added, {removed} removed", added=added, removed=removed)
+        scenes = catalog.query(aoi, start, end, min_bands=8)
+    finally:
+        catalog.close()
+    METRICS.event(f"{len(scenes)} scenes match the AOI/date filter", scenes=len(scenes))
+    return members_by_zip(scenes)
+
+def process_all_zips(num_workers=None, aoi=None, start=None, end=None):
+    """Extract patches from every ZIP in ZIP_DIR.
+
+    aoi (west, south, east, north in lon/lat) and start/end dates limit the
+    run to the scenes the catalog finds inside them; other members are
+    never opened.
+    """
+    num_workers = num_workers or NUM_WORKERS
+    METRICS.configure(METRICS_PATH, METRICS_ENABLED, echo=True)
+    zip_files = [f for f in os.listdir(ZIP_DIR) if f.lower().endswith('.zip')]
+    METRICS.event(f"Total ZIP files in '{ZIP_DIR}': {len(zip_files)}", zips=len(zip_files))
+    manifest = open_manifest()
+    if manifest is not None:
+        zip_files = [f for f in zip_files if not manifest.zip_is_complete(os.path.join(ZIP_DIR, f))]
+        METRICS.event(f"{len(zip_files)} ZIP files new or incomplete since the last run", zips=len(zip_files))
+    try:
+        members = None
+        if aoi is not None or start is not None or end is not None:
+            members = catalog_members(aoi, start, end)
+            zip_files = [f for f in zip_files if os.path.abspath(os.path.join(ZIP_DIR, f)) in members]
+        if num_workers > 1:
+            process_scenes_parallel([os.path.join(ZIP_DIR, f) for f in zip_files], num_workers, manifest,
+                                    members)
+            return
+        for zipf in tqdm(zip_files, desc="Processing ZIP files"):
+            zip_path = os.path.join(ZIP_DIR, zipf)
+            try:
+                process_zip(zip_path, manifest, members)
+            except zipfile.BadZipFile:
+                print(f"[!] Corrupt ZIP file: {zipf}")
+                continue
+    finally:
+        if manifest is not None:
+            manifest.close()
+        METRICS.report()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract water patches from the Sentinel-2 ZIPs in ZIP_DIR.")
+    parser.add_argument('--workers', type=int, help="Scene worker processes (default: NUM_WORKERS)")
+    parser.add_argument('--aoi', type=float, nargs=4, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+                        help="Only scenes intersecting this lon/lat box")
+    parser.add_argument('--start', help="Only scenes acquired on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Only scenes acquired on or before this date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+    process_all_zips(args.workers, args.aoi, args.start, args.end)
 
 if __name__ == "__main__":
-    process_all_zips()
+    main()
@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import sqlite3
+
+
+class IngestManifest:
+    """SQLite record of which ZIP members have been turned into patches.
+
+    A member is complete when a 'done' row exists for the same ZIP path,
+    member name, uncompressed size, CRC-32 and extraction parameters. ZIPs
+    whose size and mtime are unchanged since every member completed are
+    skipped without being opened, so a re-run only pays for new or changed
+    data.
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = json.dumps(params, sort_keys=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS members (
+                zip_path TEXT NOT NULL,
+                member TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                crc INTEGER NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                patch_count INTEGER,
+                elapsed REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (zip_path, member)
+            );
+            CREATE TABLE IF NOT EXISTS zips (
+                zip_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                params TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def zip_is_complete(self, zip_path):
+        row = self.conn.execute(
+            "SELECT size, mtime, params FROM zips WHERE zip_path = ?", (os.path.abspath(zip_path),)
+        ).fetchone()
+        if row is None:
+            return False
+        stat = os.stat(zip_path)
+        return row == (stat.st_size, stat.st_mtime, self.params)
+
+    def pending_members(self, zip_path, infos):
+        """Filter ZipInfo objects down to the members that still need processing."""
+        done = {
+            (member, size, crc) for member, size, crc in self.conn.execute(
+                "SELECT member, size, crc FROM members WHERE zip_path = ? AND params = ? AND status = 'done'",
+                (os.path.abspath(zip_path), self.params))
+        }
+        return [info for info in infos if (info.filename, info.file_size, info.CRC) not in done]
+
+    def record(self, zip_path, info, status, patch_count=None, elapsed=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(zip_path), info.filename, info.file_size, info.CRC, self.params,
+             status, patch_count, elapsed, time.time()))
+        self.conn.commit()
+
+    def finish_zip(self, zip_path, infos):
+        # Only remember the ZIP as a whole once every member is done
+        if self.pending_members(zip_path, infos):
+            return False
+        stat = os.stat(zip_path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO zips VALUES (?, ?, ?, ?)",
+            (os.path.abspath(zip_path), stat.st_size, stat.st_mtime, self.params))
+        self.conn.commit()
+        return True
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,113 @@
+import os
+import json
+import glob
+import numpy as np
+
+
+class PatchShardWriter:
+    """Append a scene's patches to fixed-size .npy shards plus a JSON index.
+
+    Each shard is a (count, patch_size, patch_size, 3) array written with
+    np.save, so readers can memory-map it and pull out one patch without
+    touching the rest. The scene's index file lists the shards and, per
+    patch, its pixel origin and water fraction. Writing a scene again
+    replaces its previous shards.
+    """
+
+    def __init__(self, output_dir, scene, patch_size, dtype='uint16', shard_size=1024):
+        self.output_dir = output_dir
+        self.scene = scene
+        self.patch_size = patch_size
+        self.dtype = np.dtype(dtype)
+        self.shard_size = shard_size
+        self.buffer = np.empty((shard_size, patch_size, patch_size, 3), dtype=self.dtype)
+        self.count = 0
+        self.shards = []
+        self.patches = []
+        self.remove_existing()
+
+    def shard_name(self, index):
+        return f"{self.scene}-shard{index:04d}.npy"
+
+    def index_path(self):
+        return os.path.join(self.output_dir, f"{self.scene}.index.json")
+
+    def remove_existing(self):
+        pattern = os.path.join(glob.escape(self.output_dir),
+                               glob.escape(self.scene) + "-shard[0-9][0-9][0-9][0-9].npy")
+        for path in glob.glob(pattern) + [self.index_path()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def add(self, patch, x, y, water_fraction):
+        self.buffer[self.count] = patch
+        self.patches.append({'shard': len(self.shards), 'row': self.count,
+                             'x': int(x), 'y': int(y), 'water_fraction': float(water_fraction)})
+        self.count += 1
+        if self.count == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if self.count == 0:
+            return
+        name = self.shard_name(len(self.shards))
+        np.save(os.path.join(self.output_dir, name), self.buffer[:self.count])
+        self.shards.append({'file': name, 'count': self.count})
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        index = {
+            'scene': self.scene,
+            'patch_size': self.patch_size,
+            'dtype': self.dtype.name,
+            'shards': self.shards,
+            'patches': self.patches,
+        }
+        with open(self.index_path(), 'w') as f:
+            json.dump(index, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't leave a half-written scene behind
+            self.remove_existing()
+        return False
+
+
+class PatchShardReader:
+    """Random access over every scene index in a shard directory.
+
+    reader[i] returns (patch, meta) where meta holds the scene, x, y and
+    water_fraction of the patch. Shards are opened memory-mapped, so only
+    the requested patch is read from disk.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.entries = []
+        for index_path in sorted(glob.glob(os.path.join(glob.escape(output_dir), "*.index.json"))):
+            with open(index_path) as f:
+                index = json.load(f)
+            for patch in index['patches']:
+                meta = dict(patch, scene=index['scene'],
+                            file=index['shards'][patch['shard']]['file'])
+                self.entries.append(meta)
+        self.arrays = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def shard(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.output_dir, name), mmap_mode='r')
+        return self.arrays[name]
+
+    def __getitem__(self, i):
+        meta = self.entries[i]
+        patch = np.asarray(self.shard(meta['file'])[meta['row']])
+        return patch, {key: meta[key] for key in ('scene', 'x', 'y', 'water_fraction')}
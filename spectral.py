@@ -0,0 +1,84 @@
+import numpy as np
+
+EPSILON = 1e-6              # Added to every denominator to avoid zero division
+INT16_SCALE = 10000         # int16 outputs hold round(index * INT16_SCALE)
+
+# Normalized-difference indices as (a, b) for (a - b) / (a + b)
+INDICES = {
+    'NDVI': ('nir', 'red'),
+    'NDWI': ('green', 'nir'),
+    'MNDWI': ('green', 'swir1'),
+    'NDBI': ('swir1', 'nir'),
+}
+
+
+def normalized_difference(a, b, eps=EPSILON, out=None, scratch=None):
+    """(a - b) / (a + b + eps) in float32, using out and scratch as the only buffers.
+
+    Integer inputs are promoted to float32 element by element inside the
+    ufuncs, so a + b can't overflow the source dtype (uint16 sums wrap
+    otherwise). out and scratch are allocated if not given.
+    """
+    if out is None:
+        out = np.empty(np.shape(a), dtype=np.float32)
+    if scratch is None:
+        scratch = np.empty(np.shape(a), dtype=np.float32)
+    np.subtract(a, b, out=out, dtype=np.float32)
+    np.add(a, b, out=scratch, dtype=np.float32)
+    scratch += eps
+    np.divide(out, scratch, out=out)
+    return out
+
+
+class SpectralKernel:
+    """Several normalized-difference indices over shared band windows, without per-window allocations.
+
+    Buffers are sized for max_shape once; each compute() call converts
+    every band it needs to float32 once and evaluates all requested
+    indices from those copies. Results are views into the kernel's
+    buffers and are overwritten by the next call, so one kernel serves
+    one thread. dtype 'float16' or 'int16' (scaled by INT16_SCALE) gives
+    compact outputs.
+    """
+
+    def __init__(self, max_shape, indices, dtype='float32', eps=EPSILON):
+        unknown = set(indices) - set(INDICES)
+        if unknown:
+            raise ValueError(f"Unknown spectral indices: {sorted(unknown)}")
+        self.indices = list(indices)
+        self.bands = sorted({band for name in self.indices for band in INDICES[name]})
+        self.dtype = np.dtype(dtype)
+        self.eps = eps
+        self.band_buffers = {band: np.empty(max_shape, dtype=np.float32) for band in self.bands}
+        self.scratch = np.empty(max_shape, dtype=np.float32)
+        self.float_buffers = {name: np.empty(max_shape, dtype=np.float32) for name in self.indices}
+        self.out_buffers = {}
+        if self.dtype != np.float32:
+            self.out_buffers = {name: np.empty(max_shape, dtype=self.dtype) for name in self.indices}
+
+    def compute(self, bands):
+        """Indices for one window; bands maps band names ('red', 'nir', ...) to arrays."""
+        shape = np.shape(bands[self.bands[0]])
+        view = tuple(slice(0, n) for n in shape)
+        floats = {}
+        for band in self.bands:
+            floats[band] = self.band_buffers[band][view]
+            np.copyto(floats[band], bands[band], casting='unsafe')
+        scratch = self.scratch[view]
+        results = {}
+        for name in self.indices:
+            a, b = INDICES[name]
+            index = normalized_difference(floats[a], floats[b], self.eps,
+                                          out=self.float_buffers[name][view], scratch=scratch)
+            if self.dtype == np.int16:
+                out = self.out_buffers[name][view]
+                np.multiply(index, INT16_SCALE, out=index)
+                np.rint(index, out=index)
+                np.copyto(out, index, casting='unsafe')
+                index = out
+            elif self.dtype != np.float32:
+                out = self.out_buffers[name][view]
+                np.copyto(out, index, casting='same_kind')
+                index = out
+            results[name] = index
+        return results
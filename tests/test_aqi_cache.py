@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'aelous')))
+from aqi_cache import AQICache, SOURCE_TZ, UPDATE_GRACE, UPDATE_INTERVAL, parse_last_update
+
+
+def test_last_update_is_read_as_ist_on_any_host(monkeypatch):
+    expected = datetime(2025, 3, 21, 8, 30, tzinfo=timezone.utc).timestamp()
+    for tz in ('UTC', 'America/New_York', 'Asia/Kolkata'):
+        monkeypatch.setenv('TZ', tz)
+        time.tzset()
+        assert parse_last_update("21-03-2025 14:00:00") == expected
+    monkeypatch.delenv('TZ')
+    time.tzset()
+
+
+class StubClient:
+    def __init__(self, records):
+        self.records = records
+
+    def get_city(self, city):
+        return self.records
+
+
+def test_entry_expires_an_update_interval_after_last_update():
+    # Published 30 minutes ago, IST
+    published = time.time() - 1800
+    stamp = datetime.fromtimestamp(published, SOURCE_TZ).strftime("%d-%m-%Y %H:%M:%S")
+    cache = AQICache(StubClient([{'last_update': stamp}]))
+    try:
+        cache.get('Delhi')
+        assert abs(cache.expiry('Delhi') - (int(published) + UPDATE_INTERVAL + UPDATE_GRACE)) < 1
+        assert cache.lookup('Delhi')[1] == 'hit'
+    finally:
+        cache.close()
@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+
+pytest.importorskip('requests')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'aelous')))
+from aqi_client import AQIClient
+
+RECORDS = [{'city': f"City {i % 7}", 'station': f"Station {i}", 'pollutant_id': 'PM2.5', 'avg_value': str(i)}
+           for i in range(250)]
+SERVER_LIMIT = 100
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """data.gov.in stand-in that returns at most SERVER_LIMIT records, whatever limit asks for."""
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        offset = int(params['offset'][0])
+        limit = min(int(params['limit'][0]), SERVER_LIMIT)
+        self.server.requests.append((offset, limit))
+        body = json.dumps({'total': len(RECORDS), 'records': RECORDS[offset:offset + limit]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_records_pages_past_a_capped_limit(stub_server):
+    client = AQIClient('key', base_url=f"http://127.0.0.1:{stub_server.server_port}/", page_size=1000)
+    try:
+        records = client.fetch_records()
+    finally:
+        client.close()
+    assert records == RECORDS
+    assert [offset for offset, _ in stub_server.requests] == [0, 100, 200]
@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'aelous')))
+from aqi_engine import aqi_category, compute_aqi, sub_index
+
+
+def test_pm25_sub_index_band_edges():
+    # 30 is the top of the first band; 90 the top of the third
+    values = sub_index('PM2.5', [0, 30, 31, 60, 90, np.nan])
+    np.testing.assert_allclose(values, [0, 50, 50 + 50 / 30, 100, 200, np.nan])
+
+
+def test_top_band_is_extended_and_capped():
+    # 250-380 maps onto 401-500, and anything beyond stays at 500
+    np.testing.assert_allclose(sub_index('PM2.5', [300, 380, 1000]), [400 + 50 * 100 / 130, 500, 500])
+
+
+def test_category_edges_belong_to_the_lower_band():
+    assert list(aqi_category([50, 51, 100, 101, 500, np.nan])) == [
+        'Good', 'Satisfactory', 'Satisfactory', 'Moderate', 'Severe', None]
+
+
+def test_aqi_needs_three_pollutants_including_pm():
+    readings = pd.DataFrame({
+        'PM2.5': [90, np.nan, 31],
+        'NO2': [40, 100, np.nan],
+        'OZONE': [50, 60, 10],
+        'SO2': [10, 20, np.nan],
+    })
+    result = compute_aqi(readings)
+    assert result['aqi'][0] == 200
+    assert result['dominant_pollutant'][0] == 'PM2.5'
+    assert result['category'][0] == 'Moderate'
+    # No PM reading, then only two pollutants: no AQI
+    for row in (1, 2):
+        assert result.loc[row].isna().all()
+
+
+def test_ozone_alias_counts_as_o3():
+    result = compute_aqi(pd.DataFrame({'pm10': [40], 'no2': [10], 'OZONE': [168]}))
+    assert result['aqi'][0] == 200
+    assert result['dominant_pollutant'][0] == 'O3'
@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'aelous')))
+from aqi_cache import SOURCE_TZ
+from aqi_history import AQIHistory
+
+
+def stamp(moment):
+    return moment.astimezone(SOURCE_TZ).strftime("%d-%m-%Y %H:%M:%S")
+
+
+def test_latest_reading_is_in_the_24h_range_on_a_utc_host(tmp_path, monkeypatch):
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    try:
+        history = AQIHistory(str(tmp_path / 'history.sqlite'))
+        now = datetime.now(SOURCE_TZ).replace(minute=0, second=0, microsecond=0)
+        history.append('Delhi', {'A': {'last_update': stamp(now), 'aqi': 120.0},
+                                 'B': {'last_update': stamp(now - timedelta(hours=2)), 'aqi': 80.0}})
+        dates, values = history.recent('Delhi', '24h')
+        assert dates == [now - timedelta(hours=2), now]
+        assert values == [80.0, 120.0]
+        history.close()
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
+
+
+def test_daily_buckets_start_at_ist_midnight(tmp_path):
+    history = AQIHistory(str(tmp_path / 'history.sqlite'))
+    day = datetime(2025, 3, 21, tzinfo=SOURCE_TZ)
+    history.append('Delhi', {'A': {'last_update': stamp(day + timedelta(hours=1)), 'aqi': 100.0},
+                             'B': {'last_update': stamp(day + timedelta(hours=23)), 'aqi': 200.0}})
+    dates, values = history.recent('Delhi', '30d', now=day + timedelta(days=1))
+    assert dates == [day]
+    assert values == [150.0]
+    history.close()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+from run_benchmarks import compare
+
+BASELINE = {'case': {'seconds': 1.0, 'peak_rss_mb': 100.0, 'bytes_read': 1000}}
+
+
+def test_compare_flags_time_memory_and_io_growth():
+    assert compare({'case': {'seconds': 1.1, 'peak_rss_mb': 110.0, 'bytes_read': 1100}}, BASELINE, 0.2) == []
+    assert compare({'case': {'seconds': 1.5, 'peak_rss_mb': 100.0, 'bytes_read': 1000}}, BASELINE, 0.2) == ['case']
+    assert compare({'case': {'seconds': 1.0, 'peak_rss_mb': 150.0, 'bytes_read': 1000}}, BASELINE, 0.2) == ['case']
+    assert compare({'case': {'seconds': 1.0, 'peak_rss_mb': 100.0, 'bytes_read': 5000}}, BASELINE, 0.2) == ['case']
+    # Results without bytes_read (non-Linux) are still compared on the rest
+    assert compare({'case': {'seconds': 1.0, 'peak_rss_mb': 100.0}}, BASELINE, 0.2) == []
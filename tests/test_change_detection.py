@@ -0,0 +1,63 @@
+import os
+import sys
+import datetime
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+gpd = pytest.importorskip('geopandas')
+from rasterio.transform import from_origin
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'gaia')))
+import change_detection
+from change_detection import GreenCoverChange, overlapping_scenes
+from test_ndvi_engine import CRS, write_band
+
+
+def write_date(tmp_path, day, origin=(500000.0, 2000000.0), size=256):
+    rng = np.random.default_rng(day)
+    transform = from_origin(origin[0], origin[1], 10.0, 10.0)
+    red = write_band(tmp_path / f'red_{day}.tif',
+                     rng.integers(500, 2000, size=(size, size), dtype=np.uint16), transform)
+    nir = write_band(tmp_path / f'nir_{day}.tif',
+                     rng.integers(500, 4000, size=(size, size), dtype=np.uint16), transform)
+    return datetime.date(2023, 1, day), red, nir
+
+
+def test_scenes_outside_the_boundary_are_skipped(tmp_path):
+    scenes = [write_date(tmp_path, 1), write_date(tmp_path, 2, origin=(600000.0, 2000000.0)),
+              write_date(tmp_path, 3)]
+    gdf = gpd.GeoDataFrame(geometry=[box(500100.0, 1998000.0, 501000.0, 1999900.0)], crs=CRS)
+    kept = overlapping_scenes(scenes, gdf)
+    assert [scene[0].day for scene in kept] == [1, 3]
+    zone_loss = GreenCoverChange(kept, block_size=128).run(0.3, str(tmp_path), [gdf.geometry[0].__geo_interface__])
+    assert zone_loss.shape == (1, 2)
+
+
+@pytest.mark.parametrize('days', [2, 6])
+def test_threads_are_capped_by_open_handles_not_dates(tmp_path, monkeypatch, days):
+    scenes = [write_date(tmp_path, day) for day in range(1, days + 1)]
+    calls = []
+    open_now = []
+    map_region = change_detection.map_region
+    open_aligned = change_detection.open_aligned
+
+    def spy_map(region, block_size, paths, fn, num_threads, *args):
+        calls.append(num_threads)
+        return map_region(region, block_size, paths, fn, num_threads, *args)
+
+    def spy_open(path, grid, stack):
+        open_now.append(path)
+        stack.callback(open_now.remove, path)
+        # A thread never holds more than one date's bands
+        assert len(open_now) <= 2 * calls[0]
+        return open_aligned(path, grid, stack)
+
+    monkeypatch.setattr(change_detection, 'map_region', spy_map)
+    monkeypatch.setattr(change_detection, 'open_aligned', spy_open)
+    monkeypatch.setattr(change_detection, 'MAX_OPEN_DATASETS', 20)
+    GreenCoverChange(scenes, block_size=128, num_threads=16).run(0.3, str(tmp_path))
+    # 4 handles per thread (2 bands, 2 possible VRTs), 20 at most, whatever the stack length
+    assert calls == [5]
+    assert not open_now
@@ -0,0 +1,96 @@
+import os
+import sys
+import importlib
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+cv2 = pytest.importorskip('cv2')
+from rasterio.transform import from_origin
+pytest.importorskip('tqdm')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'poseidon')))
+
+HEIGHT, WIDTH = 520, 600
+
+
+@pytest.fixture
+def extract_tiff(tmp_path, monkeypatch):
+    # The module creates OUTPUT_DIR on import, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module('extract_tiff')
+    monkeypatch.setattr(module, 'OUTPUT_FORMAT', 'jpg')
+    return module
+
+
+@pytest.fixture
+def scene(tmp_path):
+    """8-band uint16 scene whose water fraction drifts around one half, so many tiles sit near the cut."""
+    rng = np.random.default_rng(0)
+    bands = rng.integers(200, 3000, size=(8, HEIGHT, WIDTH), dtype=np.uint16)
+    water_odds = 0.35 + 0.3 * np.linspace(0, 1, WIDTH)[None, :] * np.linspace(1, 0.5, HEIGHT)[:, None]
+    water = rng.random((HEIGHT, WIDTH)) < water_odds
+    bands[2][water] = 40000    # green (band 3) well above NIR: NDWI > 0.2
+    bands[7][water] = 1000     # NIR (band 8)
+    path = str(tmp_path / 'scene.tif')
+    with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=8, dtype='uint16',
+                       crs='EPSG:32643', transform=from_origin(500000.0, 2000000.0, 10.0, 10.0),
+                       tiled=True, blockxsize=128, blockysize=128) as dst:
+        dst.write(bands)
+    return path, bands
+
+
+def old_tile_loop(water_mask, patch_size, stride):
+    # The original nested loops, with the stride made a parameter
+    h, w = water_mask.shape
+    return {(x, y) for y in range(0, h - patch_size + 1, stride) for x in range(0, w - patch_size + 1, stride)
+            if np.mean(water_mask[y:y + patch_size, x:x + patch_size]) > 0.5}
+
+
+def old_patches(module, tiff_path, bands, out_dir, stride):
+    """What the original extract_water_patches wrote, generalized to a stride: {file name: bytes}."""
+    ndwi = (bands[2].astype(np.float32) - bands[7].astype(np.float32)) / (bands[2] + bands[7] + 1e-5)
+    rgb = np.stack([bands[3], bands[2], bands[1]], axis=-1)
+    size = module.PATCH_SIZE
+    os.makedirs(out_dir)
+    for x, y in old_tile_loop(ndwi > module.NDWI_THRESHOLD, size, stride):
+        patch = cv2.normalize(rgb[y:y + size, x:x + size, :], None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        cv2.imwrite(os.path.join(out_dir, f"scene_{x}_{y}.jpg"), patch)
+    return read_dir(out_dir)
+
+
+def read_dir(path):
+    contents = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as f:
+            contents[name] = f.read()
+    return contents
+
+
+@pytest.mark.parametrize('stride', [128, 64, 96, 50])
+def test_tile_selection_matches_the_old_loop(extract_tiff, stride):
+    rng = np.random.default_rng(stride)
+    mask = rng.random((HEIGHT, WIDTH)) < np.linspace(0.4, 0.6, WIDTH)[None, :]
+    # Tiles exactly half water are not selected, like np.mean(tile) > 0.5
+    mask[:128, :128] = np.arange(128 * 128).reshape(128, 128) % 2 == 0
+    selected = extract_tiff.select_water_tiles(mask, stride)
+    found = {(int(ix) * stride, int(iy) * stride) for iy, ix in zip(*np.nonzero(selected))}
+    assert found == old_tile_loop(mask, extract_tiff.PATCH_SIZE, stride)
+    assert (0, 0) not in found
+
+
+@pytest.mark.parametrize('stride, window_size', [(128, 1024), (128, 300), (64, 256), (96, 300), (96, 1000)])
+def test_engines_write_the_old_patches_byte_for_byte(extract_tiff, scene, tmp_path, monkeypatch,
+                                                      stride, window_size):
+    tiff_path, bands = scene
+    expected = old_patches(extract_tiff, tiff_path, bands, str(tmp_path / 'old'), stride)
+    assert expected
+    monkeypatch.setattr(extract_tiff, 'PATCH_STRIDE', stride)
+    monkeypatch.setattr(extract_tiff, 'WINDOW_SIZE', window_size)
+    for engine in ('full', 'windowed'):
+        out_dir = str(tmp_path / engine)
+        os.makedirs(out_dir)
+        monkeypatch.setattr(extract_tiff, 'OUTPUT_DIR', out_dir)
+        monkeypatch.setattr(extract_tiff, 'ENGINE', engine)
+        assert extract_tiff.extract_water_patches(tiff_path) == len(expected)
+        assert read_dir(out_dir) == expected, engine
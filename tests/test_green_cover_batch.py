@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+gpd = pytest.importorskip('geopandas')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('tqdm')
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'gaia')))
+from green_cover_batch import run_batch
+from test_ndvi_engine import CRS, write_band
+
+
+def test_failed_scene_keeps_a_row_per_zone(tmp_path):
+    rng = np.random.default_rng(0)
+    red_path = write_band(tmp_path / 'red.tif', rng.integers(500, 2000, size=(256, 256), dtype=np.uint16))
+    nir_path = write_band(tmp_path / 'nir.tif', rng.integers(500, 4000, size=(256, 256), dtype=np.uint16))
+    boundary = str(tmp_path / 'zones.gpkg')
+    gpd.GeoDataFrame({'ward': ['north', 'south']},
+                     geometry=[box(500000.0, 1998720.0, 501280.0, 2000000.0),
+                               box(500000.0, 1997440.0, 501280.0, 1998720.0)], crs=CRS).to_file(boundary)
+    scenes = [{'scene': 'good', 'red': red_path, 'nir': nir_path},
+              {'scene': 'broken', 'red': str(tmp_path / 'missing_red.tif'), 'nir': nir_path}]
+    output = str(tmp_path / 'table.csv')
+    run_batch(scenes, boundary, output, id_field='ward', num_workers=1)
+
+    table = pd.read_csv(output)
+    assert list(zip(table['scene'], table['zone'], table['status'])) == [
+        ('broken', 'north', 'failed'), ('broken', 'south', 'failed'),
+        ('good', 'north', 'done'), ('good', 'south', 'done')]
+    assert table.loc[table['status'] == 'failed', ['total_pixels', 'green_percentage']].isna().all().all()
+    good = table[table['status'] == 'done']
+    assert list(good['total_pixels']) == [128 * 128, 128 * 128]
+    # Pixel counts stay whole numbers in the CSV
+    with open(output) as f:
+        assert ',16384,' in f.read()
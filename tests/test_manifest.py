@@ -0,0 +1,88 @@
+import os
+import sys
+import zipfile
+import importlib
+import pytest
+
+pytest.importorskip('rasterio')
+pytest.importorskip('cv2')
+pytest.importorskip('tqdm')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'poseidon')))
+from manifest import IngestManifest
+
+PARAMS = {'PATCH_SIZE': 128, 'PATCH_STRIDE': 128}
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def tif_infos(zip_path):
+    with zipfile.ZipFile(zip_path) as zf:
+        return [info for info in zf.infolist() if info.filename.endswith('.tif')]
+
+
+@pytest.fixture
+def extract_tiff(tmp_path, monkeypatch):
+    # The module creates OUTPUT_DIR on import, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module('extract_tiff')
+    monkeypatch.setattr(module, 'READ_MODE', 'vsizip')
+    return module
+
+
+def run(module, monkeypatch, zip_path, manifest, results):
+    """process_zip with extraction stubbed out; returns the members it processed."""
+    processed = []
+
+    def extract(path):
+        member = os.path.basename(path)
+        processed.append(member)
+        return results.get(member, 1)
+
+    monkeypatch.setattr(module, 'extract_water_patches', extract)
+    module.process_zip(zip_path, manifest)
+    return processed
+
+
+def test_resume_skips_done_members_and_retries_failed_ones(extract_tiff, tmp_path, monkeypatch):
+    zip_path = write_zip(tmp_path / 'scenes.zip', {'a.tif': b'a' * 100, 'b.tif': b'b' * 100, 'c.tif': b'c'})
+    manifest = IngestManifest(str(tmp_path / 'manifest.sqlite'), PARAMS)
+    # b fails (engines return None), so the ZIP isn't complete yet
+    assert run(extract_tiff, monkeypatch, zip_path, manifest, {'b.tif': None}) == ['a.tif', 'b.tif', 'c.tif']
+    assert not manifest.zip_is_complete(zip_path)
+    assert run(extract_tiff, monkeypatch, zip_path, manifest, {}) == ['b.tif']
+    assert manifest.zip_is_complete(zip_path)
+    assert run(extract_tiff, monkeypatch, zip_path, manifest, {}) == []
+    manifest.close()
+
+
+def test_changed_member_is_processed_again(extract_tiff, tmp_path, monkeypatch):
+    zip_path = str(tmp_path / 'scenes.zip')
+    write_zip(zip_path, {'a.tif': b'a' * 100, 'b.tif': b'b' * 100})
+    manifest = IngestManifest(str(tmp_path / 'manifest.sqlite'), PARAMS)
+    run(extract_tiff, monkeypatch, zip_path, manifest, {})
+    # Same name and size, new contents: only the CRC differs
+    write_zip(zip_path, {'a.tif': b'a' * 100, 'b.tif': b'B' * 100})
+    os.utime(zip_path, (0, 0))
+    assert not manifest.zip_is_complete(zip_path)
+    assert [info.filename for info in manifest.pending_members(zip_path, tif_infos(zip_path))] == ['b.tif']
+    assert run(extract_tiff, monkeypatch, zip_path, manifest, {}) == ['b.tif']
+    manifest.close()
+
+
+def test_other_parameters_start_over(tmp_path):
+    zip_path = write_zip(tmp_path / 'scenes.zip', {'a.tif': b'a'})
+    path = str(tmp_path / 'manifest.sqlite')
+    manifest = IngestManifest(path, PARAMS)
+    manifest.record(zip_path, tif_infos(zip_path)[0], 'done', 3)
+    assert manifest.finish_zip(zip_path, tif_infos(zip_path))
+    manifest.close()
+    manifest = IngestManifest(path, dict(PARAMS, PATCH_STRIDE=64))
+    assert not manifest.zip_is_complete(zip_path)
+    assert len(manifest.pending_members(zip_path, tif_infos(zip_path))) == 1
+    manifest.close()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from metrics import Metrics
+
+
+def run(metrics, scenes, path):
+    metrics.configure(path)
+    for name in scenes:
+        with metrics.scene(name) as scene:
+            with metrics.span('read', pixels=10):
+                pass
+        metrics.add_record(scene.record)
+    return metrics.report()
+
+
+def test_each_run_summarizes_only_its_own_scenes(tmp_path):
+    metrics = Metrics(enabled=False)
+    path = str(tmp_path / 'metrics.jsonl')
+    assert run(metrics, ['a', 'b', 'c'], path)['scenes'] == 3
+    summary = run(metrics, ['d'], path)
+    assert summary['scenes'] == 1
+    assert summary['counts'] == {'pixels': 10}
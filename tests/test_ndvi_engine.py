@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'gaia')))
+from ndvi_engine import NDVIEngine, map_region, raster_grid
+
+CRS = 'EPSG:32643'
+
+
+def write_band(path, data, transform=from_origin(500000.0, 2000000.0, 10.0, 10.0)):
+    with rasterio.open(path, 'w', driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs=CRS, transform=transform, tiled=True,
+                       blockxsize=128, blockysize=128) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+@pytest.fixture
+def red_nir(tmp_path):
+    rng = np.random.default_rng(0)
+    red = rng.integers(500, 2000, size=(512, 512), dtype=np.uint16)
+    nir = rng.integers(500, 4000, size=(512, 512), dtype=np.uint16)
+    return write_band(tmp_path / 'red.tif', red), write_band(tmp_path / 'nir.tif', nir), red, nir
+
+
+def test_map_region_threads_read_and_close_handles(red_nir):
+    red_path, nir_path, red, _ = red_nir
+    with rasterio.open(red_path) as src:
+        grid = raster_grid(src)
+    threads = set()
+
+    def block_sum(datasets, window, src_window):
+        threads.add(threading.get_ident())
+        return window, int(datasets[0].read(1, window=src_window).sum())
+
+    blocks = list(map_region(Window(0, 0, 512, 512), 128, [red_path, nir_path], block_sum,
+                             num_threads=4, grid=grid))
+    assert len(blocks) == 16
+    assert sum(total for _, total in blocks) == int(red.sum(dtype=np.int64))
+    assert len(threads) > 1
+
+
+def test_map_region_threads_with_warped_band(red_nir, tmp_path):
+    red_path, _, _, nir = red_nir
+    # Half a pixel off the red grid, so NIR is read through a WarpedVRT
+    shifted = write_band(tmp_path / 'nir_shifted.tif', nir, from_origin(500005.0, 2000000.0, 10.0, 10.0))
+    engine = NDVIEngine(red_path, shifted, block_size=128, num_threads=4)
+    assert not engine.aligned
+    stats = engine.run(0.3)
+    assert stats['total_pixels'] == 512 * 512
+
+
+def test_run_matches_whole_raster_ndvi(red_nir):
+    red_path, nir_path, red, nir = red_nir
+    stats = NDVIEngine(red_path, nir_path, block_size=128, num_threads=4).run(0.3)
+    ndvi = (nir.astype(np.float32) - red) / (nir.astype(np.float32) + red + 1e-6)
+    assert stats['total_pixels'] == red.size
+    assert stats['green_pixels'] == int((ndvi > 0.3).sum())
+
+
+def square(left, top, size):
+    return {'type': 'Polygon', 'coordinates': [[(left, top - size), (left + size, top - size),
+                                                (left + size, top), (left, top), (left, top - size)]]}
+
+
+def test_overlapping_zones_each_count_shared_pixels(red_nir):
+    red_path, nir_path, _, _ = red_nir
+    engine = NDVIEngine(red_path, nir_path, block_size=128, num_threads=2)
+    # Two 256-pixel squares overlapping by half, and a third covering both
+    zones = [square(500000.0, 2000000.0, 2560.0), square(501280.0, 2000000.0, 2560.0),
+             square(500000.0, 2000000.0, 3840.0)]
+    totals, greens = engine.run_zones(0.3, zones)
+    assert list(totals) == [256 * 256, 256 * 256, 384 * 384]
+    stats = engine.run(0.3, zones)
+    # The overall count takes each pixel once
+    assert stats['total_pixels'] == 384 * 384
+    assert greens[2] == stats['green_pixels']
+
+
+def test_write_outputs_counts_match_written_mask(red_nir, tmp_path):
+    red_path, nir_path, _, _ = red_nir
+    engine = NDVIEngine(red_path, nir_path, block_size=128, num_threads=2)
+    zones = [square(500000.0, 2000000.0, 2560.0), square(501280.0, 2000000.0, 2560.0)]
+    # Off a histogram bin edge, where estimates and exact counts can differ
+    threshold = 0.3456
+    stats = engine.run(threshold, zones)
+    counts = engine.write_outputs(threshold, str(tmp_path / 'ndvi.tif'), str(tmp_path / 'green.tif'), zones)
+    with rasterio.open(tmp_path / 'green.tif') as src:
+        written = int(src.read(1).sum())
+    assert counts['green_pixels'] == stats['green_pixels'] == written
+    assert counts['total_pixels'] == stats['total_pixels']
+    assert list(counts['zone_green_pixels']) == list(stats['zone_green_pixels'])
+
+
+def test_invalid_zone_polygons_are_still_counted(red_nir):
+    red_path, nir_path, _, _ = red_nir
+    engine = NDVIEngine(red_path, nir_path, block_size=128, num_threads=2)
+    left, top = 500000.0, 2000000.0
+    # A self-intersecting bowtie whose bounds overlap its neighbour's
+    bowtie = {'type': 'Polygon', 'coordinates': [[(left, top), (left + 1280.0, top - 1280.0),
+                                                  (left + 1280.0, top), (left, top - 1280.0), (left, top)]]}
+    zones = [bowtie, square(left + 640.0, top, 1280.0)]
+    totals, _ = engine.run_zones(0.3, zones)
+    assert totals[0] > 0
+    assert totals[1] == 128 * 128
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import pytest
+
+np = pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'poseidon')))
+from shards import PatchShardReader, PatchShardWriter
+
+PATCH = 8
+
+
+def patches(count, seed):
+    return np.random.default_rng(seed).integers(0, 10000, size=(count, PATCH, PATCH, 3), dtype=np.uint16)
+
+
+def write_scene(output_dir, scene, data, shard_size):
+    with PatchShardWriter(str(output_dir), scene, PATCH, 'uint16', shard_size) as writer:
+        for i, patch in enumerate(data):
+            writer.add(patch, i * PATCH, 2 * i * PATCH, i / len(data))
+
+
+def test_round_trip_across_shard_boundaries(tmp_path):
+    a, b = patches(7, 0), patches(3, 1)
+    write_scene(tmp_path, 'a', a, shard_size=3)
+    write_scene(tmp_path, 'b', b, shard_size=3)
+    with open(tmp_path / 'a.index.json') as f:
+        assert [shard['count'] for shard in json.load(f)['shards']] == [3, 3, 1]
+
+    reader = PatchShardReader(str(tmp_path))
+    assert len(reader) == 10
+    for i, expected in enumerate(list(a) + list(b)):
+        patch, meta = reader[i]
+        np.testing.assert_array_equal(patch, expected)
+        scene, n = ('a', i) if i < 7 else ('b', i - 7)
+        assert meta == {'scene': scene, 'x': n * PATCH, 'y': 2 * n * PATCH,
+                        'water_fraction': n / (7 if scene == 'a' else 3)}
+
+
+def test_rewriting_a_scene_replaces_its_shards(tmp_path):
+    write_scene(tmp_path, 'a', patches(7, 0), shard_size=3)
+    write_scene(tmp_path, 'a', patches(2, 1), shard_size=3)
+    assert sorted(os.listdir(tmp_path)) == ['a-shard0000.npy', 'a.index.json']
+    assert len(PatchShardReader(str(tmp_path))) == 2
+
+
+def test_failed_scene_leaves_nothing_behind(tmp_path):
+    with pytest.raises(RuntimeError):
+        with PatchShardWriter(str(tmp_path), 'a', PATCH, 'uint16', 2) as writer:
+            for patch in patches(3, 0):
+                writer.add(patch, 0, 0, 1.0)
+            raise RuntimeError("read failed")
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,42 @@
+import os
+import sys
+import importlib
+import pytest
+
+np = pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'poseidon')))
+from spectral import SpectralKernel, normalized_difference
+
+# green + nir passes 65535 in every pair but the last; green < nir in the second
+GREEN = np.array([[40000, 30000, 65535, 100]], dtype=np.uint16)
+NIR = np.array([[30000, 40000, 65535, 50]], dtype=np.uint16)
+
+
+def expected(eps):
+    green, nir = GREEN.astype(np.float64), NIR.astype(np.float64)
+    return (green - nir) / (green + nir + eps)
+
+
+def test_normalized_difference_does_not_wrap_uint16():
+    np.testing.assert_allclose(normalized_difference(GREEN, NIR, eps=1e-5), expected(1e-5), rtol=1e-6)
+
+
+def test_kernel_ndwi_does_not_wrap_uint16():
+    kernel = SpectralKernel(GREEN.shape, ['NDWI'], eps=1e-5)
+    np.testing.assert_allclose(kernel.compute({'green': GREEN, 'nir': NIR})['NDWI'], expected(1e-5), rtol=1e-6)
+
+
+def test_calculate_ndwi_does_not_wrap_uint16(tmp_path, monkeypatch):
+    pytest.importorskip('rasterio')
+    pytest.importorskip('cv2')
+    pytest.importorskip('tqdm')
+    # The module creates OUTPUT_DIR on import, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    extract_tiff = importlib.import_module('extract_tiff')
+    ndwi = extract_tiff.calculate_ndwi(GREEN, NIR)
+    assert ndwi.dtype == np.float32
+    np.testing.assert_allclose(ndwi, expected(extract_tiff.NDWI_EPSILON), rtol=1e-6)
+    # The pair summing past 65535 is about 0.14, not the wrapped 10000 / 4464 = 2.24
+    assert abs(ndwi[0, 0] - 1 / 7) < 1e-6
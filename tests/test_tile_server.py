@@ -0,0 +1,103 @@
+import os
+import sys
+import math
+import time
+import threading
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+pytest.importorskip('PIL')
+pytest.importorskip('matplotlib')
+from rasterio.enums import Resampling
+from rasterio.warp import transform
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'gaia')))
+from tile_server import TileCache, TileRenderer, overview_level, tile_bounds
+from test_ndvi_engine import CRS, write_band
+
+FACTORS = [2, 4, 8]
+
+
+@pytest.fixture
+def bands_with_overviews(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for name, high in (('red', 2000), ('nir', 4000)):
+        path = write_band(tmp_path / f'{name}.tif', rng.integers(500, high, size=(512, 512), dtype=np.uint16))
+        with rasterio.open(path, 'r+') as dst:
+            dst.build_overviews(FACTORS, Resampling.average)
+        paths.append(path)
+    return paths
+
+
+def tile_over_center(z):
+    (lon,), (lat,) = transform(CRS, 'EPSG:4326', [502560.0], [1997440.0])
+    n = 1 << z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+@pytest.mark.parametrize('z, level', [(10, 2), (11, 1), (12, 0), (14, None)])
+def test_overview_level_matches_tile_resolution(bands_with_overviews, z, level):
+    with rasterio.open(bands_with_overviews[0]) as src:
+        assert overview_level(src, tile_bounds(z, *tile_over_center(z))) == level
+
+
+def test_zoomed_out_tiles_read_from_overviews(bands_with_overviews):
+    renderer = TileRenderer(*bands_with_overviews, cache_dir=None)
+    try:
+        data, source = renderer.tile('ndvi', 11, *tile_over_center(11))
+        assert source == 'render' and data
+        # Full-resolution handles are opened for their metadata; the pixels come from the 4x overview
+        reduced = [dataset for dataset in renderer.opened if dataset.width != 512]
+        assert sorted(dataset.width for dataset in reduced) == [128, 128]
+    finally:
+        renderer.close()
+
+
+def test_disk_cache_evicts_least_recently_used_tiles(tmp_path):
+    cache_dir = str(tmp_path / 'tiles')
+    # Room for two 400-byte tiles
+    cache = TileCache(max_tiles=1, cache_dir=cache_dir, max_disk_mb=1000 / (1024 * 1024))
+    for x in range(3):
+        cache.put(('green', 0.3, 10, x, 0, 'png'), bytes([x]) * 400)
+    # Reading tile 1 back from disk makes tile 2 the oldest
+    cache.tiles.clear()
+    assert cache.get(('green', 0.3, 10, 1, 0, 'png'))[1] == 'disk'
+    cache.put(('green', 0.301, 10, 3, 0, 'png'), b'\3' * 400)
+    stats = cache.stats()
+    assert (stats['disk_tiles'], stats['disk_bytes'], stats['evictions']) == (2, 800, 2)
+    assert [os.path.exists(cache.path(('green', 0.3, 10, x, 0, 'png'))) for x in range(3)] == [False, True, False]
+
+    # A cache reopened on the same directory picks up the files and the cap
+    reopened = TileCache(max_tiles=1, cache_dir=cache_dir, max_disk_mb=500 / (1024 * 1024))
+    assert reopened.stats()['disk_tiles'] == 1
+
+
+def test_concurrent_requests_render_a_tile_once(bands_with_overviews, monkeypatch):
+    renderer = TileRenderer(*bands_with_overviews, cache_dir=None)
+    renders = []
+    render = renderer.render
+
+    def slow_render(*args):
+        renders.append(args)
+        time.sleep(0.2)
+        return render(*args)
+
+    monkeypatch.setattr(renderer, 'render', slow_render)
+    x, y = tile_over_center(11)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(renderer.tile('green', 11, x, y)))
+               for _ in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        renderer.close()
+    assert len(renders) == 1
+    assert len({data for data, _ in results}) == 1
+    assert sorted(source for _, source in results).count('render') == 1
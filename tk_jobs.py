@@ -0,0 +1,98 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """Handle passed to a background job for reporting progress and checking cancellation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.progress = (0, 0)
+        self.message = ""
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def report(self, done, total, message=None):
+        """Record progress from the worker thread; raises JobCancelled once cancel() was called."""
+        self.progress = (done, total)
+        if message is not None:
+            self.message = message
+        self.check()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.name)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class JobRunner:
+    """Runs one background job at a time for a Tk app and relays its results.
+
+    fn runs on a worker thread as fn(job, *args) and must not touch any
+    widgets. The runner polls the job with root.after; progress and the
+    final on_done/on_error/on_cancel callbacks all run on the Tk thread.
+    A job submitted while another is running is rejected.
+    """
+
+    def __init__(self, root, max_workers=1, poll_ms=100):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.job = None
+        self.callbacks = None
+
+    @property
+    def busy(self):
+        return self.job is not None
+
+    def submit(self, name, fn, *args, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """Start fn in the background; returns the Job, or None if one is already running."""
+        if self.busy:
+            return None
+        job = Job(name)
+        job.future = self.pool.submit(fn, job, *args)
+        self.job = job
+        self.callbacks = (on_done, on_error, on_progress, on_cancel)
+        self.root.after(self.poll_ms, self.poll)
+        return job
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def poll(self):
+        job = self.job
+        if job is None:
+            return
+        on_done, on_error, on_progress, on_cancel = self.callbacks
+        if not job.future.done():
+            if on_progress is not None:
+                on_progress(job)
+            self.root.after(self.poll_ms, self.poll)
+            return
+
+        # Clear first so the callbacks can start the next job
+        self.job = self.callbacks = None
+        error = job.future.exception()
+        if isinstance(error, JobCancelled) or (error is None and job.cancelled):
+            if on_cancel is not None:
+                on_cancel(job)
+        elif error is not None:
+            if on_error is not None:
+                on_error(job, error)
+        elif on_done is not None:
+            on_done(job, job.future.result())
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False)